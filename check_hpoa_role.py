@@ -33,6 +33,7 @@
 
 from __future__ import absolute_import
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -46,6 +47,44 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Determine whether the Onboard Administrator is active or standby.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    ROLE_STANDBY = 'Not a valid request while running in standby mode'
+    
+    ############################################################################
+    # HC03a - determine Onboard Administrator role (active or standby)
+    #
+    # hostname2oa01> show oa status
+    # 
+    # Onboard Administrator #1 Status:
+    # 	Name:   hostname2oa01
+    # 	Role:   Active
+    # 	UID:    Off
+    # 	Status: OK
+    # 
+    # 
+    # hostname2oa01>
+    ############################################################################
+    
+    # Issue command via ssh
+    command03a_tmp = session.run('show oa status')
+    
+    # Read ssh response
+    if ROLE_STANDBY in command03a_tmp or re.search('\tRole:\s+Standby', command03a_tmp):
+        oa_role = 'OA is in standby mode'
+        command03a_resp = "OA is in Standby, so SNMP checks are suppressed."
+        command03a_exit = 3
+    elif re.search('\tRole:\s+Active', command03a_tmp):
+        oa_role = 'OA is in active mode'
+        command03a_resp = 'OA is Active'
+        command03a_exit = 0
+    else:
+        command03a_resp = 'UNKNOWN: OA role not found in show oa status output'
+        command03a_exit = 3
+    
+    return command03a_resp, command03a_exit, None
+
 def main():
     
     # Set variables
@@ -101,109 +140,17 @@ def main():
     ## Login to platform
     ############################################################################
     
-    # define some constants
-    CONN_REFUSED = 'Connection refused'
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\? '
     # sample command prompt: hostname1oa01> 
-    COMMAND_PROMPT = hostname + '\>\s'
-    
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    child.logfile = sys.stdout
-    
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        #print('Connection refused')
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        #print('ERROR! could not login with SSH.')
-        #print(child.before, child.after)
-        #print(str(child))
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('[Pp]assword: ')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        #child.expect(COMMAND_PROMPT)
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            #print('Permission denied. Possible invalid password.')
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
+    session = msp_session.connect(hostname, ipaddress, username, password,
+                                  prompt=hostname + '\>\s', newkey_password='[Pp]assword: ',
+                                  shell=False)
     
     # Now we should be at the command prompt and ready to run some commands.
     
-    ROLE_STANDBY = 'Not a valid request while running in standby mode'
-    
-    ############################################################################
-    # HC03a - determine Onboard Administrator role (active or standby)
-    #
-    # hostname2oa01> show oa status
-    # 
-    # Onboard Administrator #1 Status:
-    # 	Name:   hostname2oa01
-    # 	Role:   Active
-    # 	UID:    Off
-    # 	Status: OK
-    # 
-    # 
-    # hostname2oa01>
-    ############################################################################
-    
-    # Issue command via ssh
-    child.sendline('show oa status')
-    
-    # Read ssh response
-    i = child.expect([ROLE_STANDBY, '\tRole:\s+Standby', '\tRole:\s+Active', pexpect.TIMEOUT])
-    if i == 0 or i == 1:
-        oa_role = 'OA is in standby mode'
-        command03a_resp = "OA is in Standby, so SNMP checks are suppressed."
-        command03a_exit = 3
-    if i == 2:
-        oa_role = 'OA is in active mode'
-        command03a_resp = 'OA is Active'
-        command03a_exit = 0
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
+    command03a_resp, command03a_exit, command03a_out = check(session, hostname)
     
     # Send the results to Nagios
-    print('%s' % (command03a_resp))
-    sys.exit(command03a_exit)
-    
-    # Now exit the remote host.
-    child.sendline('exit')
+    msp_session.report(command03a_resp, command03a_exit, command03a_out, session)
     
 if __name__ == "__main__":
     main()
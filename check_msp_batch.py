@@ -0,0 +1,193 @@
+#!/usr/local/bin/python2.7
+# -*- coding: UTF-8 -*-
+#
+# Script for running several MSP checks against one Ericsson MSP server
+# over a single SSH login and sending the results to Nagios.
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# $ python check_msp_batch.py [-H hostname] [-A ipaddress] [-U username] [-P password] [-C checks] [-S] [-c command file]
+#     -H <hostname>               Remote server's hostname
+#     -A <ipaddress>              Remote server's IP address
+#     -U <username>               SSH username for the Remote server
+#     -P <password>               SSH password for the Remote server
+#     -C <checks>                 Comma separated list of checks to run
+#     -S                          Submit each result as a passive check result
+#     -c <command file>           Nagios command file used with -S
+#
+# Each check is the name of a check_msp_<name>.py script.  A check that takes
+# an argument (port, httpbind, mmsctest) is given it after a colon, and the
+# Nagios service description defaults to the check name unless one is given
+# after an equals sign:
+#
+# Example:
+# [nagios@wtc2labnag-ndc ~]$ python check_msp_batch.py -H hostname02msp1da01 -A <IP address> -U miepadm -P password -C 'disk,ifconfig,nsctrl,port:3868=MSP Port 3868,fmactivealarms'
+#
+# Without -S one line is printed per check and the exit code is the worst
+# result.  With -S every check is submitted to Nagios as a passive result for
+# its own service and only a summary is printed.
+#
+
+from __future__ import absolute_import
+import getopt
+import msp_session
+import os
+import sys
+
+
+def exit_with_usage():
+
+    print(globals()['__doc__'])
+    os._exit(1)
+
+STATE_NAMES = ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN']
+
+def parse_checks(spec):
+    # 'port:8243=MSP Port 8243' -> ('port', ['8243'], 'MSP Port 8243')
+    checks = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            item, service = item.split('=', 1)
+        else:
+            service = None
+        if ':' in item:
+            name, arg = item.split(':', 1)
+            args = [arg]
+        else:
+            name, args = item, []
+        checks.append((name, args, service or name))
+    return checks
+
+def load_check(name):
+    module = __import__('check_msp_%s' % (name))
+    return module.check
+
+def run_checks(session, hostname, checks, cancelled=None):
+    # Run each check in turn on the one session and return a list of
+    # (service, resp, exit, out).  A check that fails leaves the shell in an
+    # unknown state, so the session is resynchronised (or logged in again)
+    # before the next check.  Once the cancelled event is set no further
+    # check is started.
+    results = []
+    for name, args, service in checks:
+        if cancelled is not None and cancelled.is_set():
+            break
+        if not session.logged_in():
+            try:
+                session.login()
+            except msp_session.SessionError as e:
+                results.append((service, e.resp, e.exit, None))
+                continue
+        try:
+            check = load_check(name)
+        except (ImportError, AttributeError):
+            results.append((service, 'UNKNOWN: no such check %s' % (name), msp_session.STATE_UNKNOWN, None))
+            continue
+        try:
+            resp, exit, out = check(session, hostname, *args)
+        except msp_session.SessionError as e:
+            # the login the check needed failed
+            results.append((service, e.resp, e.exit, None))
+            continue
+        except Exception as e:
+            results.append((service, 'UNKNOWN: %s check failed: %s' % (name, e.__class__.__name__),
+                            msp_session.STATE_UNKNOWN, None))
+            try:
+                session.sync()
+            except Exception:
+                session.close()
+            continue
+        results.append((service, resp, exit, out))
+    return results
+
+def main():
+
+    ######################################################################
+    ## Parse the options, arguments, get ready, etc.
+    ######################################################################
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:C:Sc:', ['help','h','?'])
+    except Exception as e:
+        print(str(e))
+        exit_with_usage()
+    options = dict(optlist)
+    if len(args) > 1:
+        exit_with_usage()
+
+    if [elem for elem in options if elem in ['-h','--h','-?','--?','--help']]:
+        print("Help:")
+        exit_with_usage()
+
+    if '-H' in options:
+        hostname = options['-H']
+    else:
+        exit_with_usage()
+    if '-A' in options:
+        ipaddress = options['-A']
+    else:
+        exit_with_usage()
+    if '-U' in options:
+        username = options['-U']
+    else:
+        exit_with_usage()
+    if '-P' in options:
+        password = options['-P']
+    else:
+        exit_with_usage()
+    if '-C' in options:
+        checks = parse_checks(options['-C'])
+    else:
+        exit_with_usage()
+    passive = '-S' in options
+    command_file = options.get('-c')
+
+    # SSH to server once for all of the checks
+    try:
+        session = msp_session.open_cached(hostname, ipaddress, username, password)
+    except msp_session.SessionError as e:
+        results = [(service, e.resp, e.exit, None) for name, args, service in checks]
+    else:
+        results = run_checks(session, hostname, checks)
+        session.close()
+
+    batch_exit = msp_session.STATE_OK
+    counts = [0, 0, 0, 0]
+    for service, resp, exit, out in results:
+        counts[exit] += 1
+        batch_exit = msp_session.worst(batch_exit, exit)
+    batch_resp = '%s: %s checks; %s WARNING; %s CRITICAL; %s UNKNOWN' % (
+        STATE_NAMES[batch_exit], len(results), counts[1], counts[2], counts[3])
+
+    # Send the results to Nagios
+    if passive:
+        for service, resp, exit, out in results:
+            msp_session.submit_passive(hostname, service, exit, resp, out, command_file)
+        print('%s' % (batch_resp))
+        sys.exit(msp_session.STATE_OK)
+    print('%s' % (batch_resp))
+    for service, resp, exit, out in results:
+        print('%s: %s' % (service, resp))
+    sys.exit(batch_exit)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+#!/usr/local/bin/python2.7
+# -*- coding: UTF-8 -*-
+#
+# Script for checking the server states and process stats of a Ericsson MSP
+# DDC server over one SSH login and sending the results to Nagios.
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# $ python check_msp_ddc.py [-H hostname] [-A ipaddress] [-U username] [-P password] [-S] [-c command file] [-s services]
+#     -H <hostname>               Remote server's hostname
+#     -A <ipaddress>              Remote server's IP address
+#     -U <username>               SSH username for the Remote server
+#     -P <password>               SSH password for the Remote server
+#     -S                          Submit the two results as passive check results
+#     -c <command file>           Nagios command file used with -S
+#     -s <services>               Service descriptions of the serv and stat results
+#                                 used with -S (default ddcserv,ddcstat)
+#
+# Runs 'ddc_tool processinfo serv' and 'ddc_tool processinfo stat' together
+# and reads both into one snapshot of the DDC server.  check_msp_ddcserv.py
+# and check_msp_ddcstat.py answer from the same snapshot, and with the result
+# cache the second of them does not log in again.
+#
+
+from __future__ import absolute_import
+import getopt
+import msp_inventory
+import msp_session
+import os
+import re
+import sys
+
+
+def exit_with_usage():
+
+    print(globals()['__doc__'])
+    os._exit(1)
+
+DDC_TOOL = '/opt/miep/tools/ddc_tool'
+
+# 'ddc_tool processinfo serv' lists one server per line: its name first,
+# then columns of which the first one in capitals is its state ('OK',
+# 'NOT_RUNNING'); columns after the state (uptime, PID, a note) are
+# ignored.  A summary line ('Total: 8 servers, 8 OK') has no name column
+# of its own, and a column header names no server.
+SERVER_LINE = re.compile(r'^[ \t]*([A-Za-z][\w@.:/-]*\w)[ \t]+(?:\S+[ \t]+)*?([A-Z][A-Z_-]*[A-Z])(?=[ \t]|\r?$)')
+HEADER_STATES = ('STATE', 'STATUS')
+NOT_SERVERS = ('name', 'server', 'servers', 'total', 'summary')
+
+STAT_LINE = re.compile('OK:\\s+(\\d+.\\d)%,\\sno\\sredundancy:\\s+(\\d+.\\d)%,\\slost:\\s+(\\d+.\\d)%,\\sinconsistent:\\s+(\\d+.\\d)%')
+
+STAT_FIELDS = ('ok', 'no redundancy', 'lost', 'inconsistent')
+
+def servers(text):
+    # Parse 'ddc_tool processinfo serv' into [(server, state), ...].
+    rows = []
+    for line in text.splitlines():
+        m = SERVER_LINE.match(line)
+        if m is None or m.group(2) in HEADER_STATES or m.group(1).lower() in NOT_SERVERS:
+            continue
+        rows.append((m.group(1), m.group(2)))
+    return rows
+
+def snapshot(session):
+    # Run both subcommands at once, side by side where the transport can,
+    # and parse them into
+    #     {'servers': [(server, state), ...], 'stat': {'ok': '100.0', ...} or None,
+    #      'serv_out': ...}
+    (serv_out, serv_status), (stat_out, stat_status) = session.run_many(
+        [DDC_TOOL + ' processinfo serv', DDC_TOOL + ' processinfo stat'], parallel=True)
+    m = STAT_LINE.search(stat_out)
+    if m is None:
+        stat = None
+    else:
+        stat = dict(zip(STAT_FIELDS, m.groups()))
+    return {'servers': servers(serv_out), 'stat': stat, 'serv_out': serv_out}
+
+# Count the DDC server states reported OK and name the servers that are not.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check_serv(hostname, ddc):
+    # DDC server states expected OK, from the host's role
+    command11_expect = msp_inventory.get(hostname, 'ddc_servers')
+    if command11_expect is None:
+        return 'UNKNOWN: no DDC server count for %s in %s' % (hostname, msp_inventory.path()), 3, None
+    command11_expect = int(command11_expect)
+    if not ddc['servers']:
+        # no server states read is not no servers OK
+        return 'UNKNOWN: no DDC server states in ddc_tool output', 3, ddc['serv_out']
+    command11_cnt = len([server for server, state in ddc['servers'] if state == 'OK'])
+    command11_bad = ['%s (%s)' % (server, state) for server, state in ddc['servers'] if state != 'OK']
+
+    if command11_cnt >= command11_expect:
+        command11_resp = 'OK: %s DDC Server States OK' % (command11_cnt)
+        command11_exit = 0
+    elif command11_cnt == command11_expect - 1:
+        command11_resp = 'WARNING: %s DDC Server States OK' % (command11_cnt)
+        command11_exit = 1
+    else:
+        command11_resp = 'CRITICAL: %s DDC Server States OK' % (command11_cnt)
+        command11_exit = 2
+    if command11_bad:
+        command11_resp += '; not OK: %s' % (', '.join(command11_bad))
+
+    return command11_resp, command11_exit, ddc['serv_out']
+
+# Check the DDC process stat percentages.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check_stat(ddc):
+    stat = ddc['stat']
+    if stat is None:
+        return 'UNKNOWN: no process stats in ddc_tool output', 3, None
+    command10_text = '%s%%; no redundancy: %s%%; lost: %s%%; inconsistent: %s%%' % (
+        stat['ok'], stat['no redundancy'], stat['lost'], stat['inconsistent'])
+
+    if (int(float(stat['ok'])) < 100 or int(float(stat['no redundancy'])) > 0
+            or int(float(stat['lost'])) > 0 or int(float(stat['inconsistent'])) > 0):
+        command10_resp = 'WARNING: ' + command10_text
+        command10_exit = 1
+    else:
+        command10_resp = 'OK: ' + command10_text
+        command10_exit = 0
+
+    return command10_resp, command10_exit, None
+
+# Both results of one snapshot as a single check.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    ddc = snapshot(session)
+    serv_resp, serv_exit, serv_out = check_serv(hostname, ddc)
+    stat_resp, stat_exit, stat_out = check_stat(ddc)
+    return '%s / %s' % (serv_resp, stat_resp), msp_session.worst(serv_exit, stat_exit), serv_out
+
+def main():
+
+    ######################################################################
+    ## Parse the options, arguments, get ready, etc.
+    ######################################################################
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:Sc:s:', ['help','h','?'])
+    except Exception as e:
+        print(str(e))
+        exit_with_usage()
+    options = dict(optlist)
+    if len(args) > 1:
+        exit_with_usage()
+
+    if [elem for elem in options if elem in ['-h','--h','-?','--?','--help']]:
+        print("Help:")
+        exit_with_usage()
+
+    if '-H' in options:
+        hostname = options['-H']
+    else:
+        exit_with_usage()
+    if '-A' in options:
+        ipaddress = options['-A']
+    else:
+        exit_with_usage()
+    if '-U' in options:
+        username = options['-U']
+    else:
+        exit_with_usage()
+    if '-P' in options:
+        password = options['-P']
+    else:
+        exit_with_usage()
+    services = options.get('-s', 'ddcserv,ddcstat').split(',')
+    if len(services) != 2:
+        exit_with_usage()
+
+    # SSH to server
+    session = msp_session.connect(hostname, ipaddress, username, password)
+
+    # Now we should be at the command prompt and ready to run some commands.
+
+    if '-S' not in options:
+        ddc_resp, ddc_exit, ddc_out = check(session, hostname)
+        msp_session.report(ddc_resp, ddc_exit, ddc_out, session)
+
+    # Send both results to Nagios from the one snapshot
+    ddc = snapshot(session)
+    session.close()
+    for service, (resp, exit, out) in zip(services, [check_serv(hostname, ddc), check_stat(ddc)]):
+        msp_session.submit_passive(hostname, service, exit, resp, out, options.get('-c'))
+    print('OK: %s and %s submitted' % (services[0], services[1]))
+    sys.exit(msp_session.STATE_OK)
+
+if __name__ == "__main__":
+    main()
@@ -31,9 +31,11 @@
 #
 
 from __future__ import absolute_import
+import check_msp_ddc
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +51,12 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Count the DDC server states reported OK by 'ddc_tool processinfo serv'.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # The states come from the snapshot shared with check_msp_ddcstat.py
+    return check_msp_ddc.check_serv(hostname, check_msp_ddc.snapshot(session))
+
 def main():
     
     ######################################################################
@@ -85,96 +93,20 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: user@hostnamemsp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    child.sendline('/opt/miep/tools/ddc_tool processinfo serv')
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Read ssh response, post-process and write data to the csv file
-    command11_tmp = child.before
-    command11_cnt = command11_tmp.count('OK')
-    
-    if command11_cnt == 8:
-        command11_resp = 'OK: %s DDC Server States OK' % (command11_cnt)
-        command11_exit = 0
-    if command11_cnt == 7:
-        command11_resp = 'WARNING: %s DDC Server States OK' % (command11_cnt)
-        command11_exit = 1
-    if command11_cnt < 7:
-        command11_resp = 'CRITICAL: %s DDC Server States OK' % (command11_cnt)
-        command11_exit = 2
-    
+    command11_resp, command11_exit, command11_tmp = check(session, hostname)
     
     # Send the results to Nagios
     ##################################################################
-    print('%s | %s' % (command11_resp, command11_tmp))
-    sys.exit(command11_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command11_resp, command11_exit, command11_tmp, session)
     
 if __name__ == "__main__":
     main()
@@ -5,6 +5,12 @@
 # ddc_debug.log.0 of the Ericsson MSP DDC server and
 # sending the results to Nagios.
 #
+# When msp_tscollector.py is following the server, the counts of the last
+# -m minutes are taken from it and the server is not logged in to.
+# Otherwise each run counts the messages written since the previous run for
+# the same host.  The position reached is kept in
+# /var/tmp/msp_plugins/cursors, so the first run only records it.
+#
 # Written by Alan Sendgikoski <asendgi@gmail.com>
 # 
 # Licence : GNU General Public Licence (GPL) http://www.gnu.org/
@@ -23,11 +29,12 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 # 02110-1301, USA.
 # 
-# $ python check_msp_ddctscomm.py [-H hostname] [-A ipaddress] [-U username] [-P password]
+# $ python check_msp_ddctscomm.py [-H hostname] [-A ipaddress] [-U username] [-P password] [-m minutes]
 #     -H <hostname>               Remote server's hostname
 #     -A <ipaddress>              Remote server's IP address
 #     -U <username>               SSH username for the Remote server
 #     -P <password>               SSH password for the Remote server
+#     -m <minutes>                Minutes counted when msp_tscollector.py is running (default 5)
 # 
 #
 
@@ -35,6 +42,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -50,6 +58,113 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+DDC_LOG = '/var/log/miep/ddc_debug.log.0'
+# Where ddc_debug.log.0 is renamed to when the log rotates
+DDC_LOG_ROTATED = '/var/log/miep/ddc_debug.log.1'
+
+# Unanswered requests allowed in an interval before a WARNING; one request
+# may be waiting for its response right when the log is read.
+UNANSWERED_MAX = 1
+
+# Counting is done on the server, so only two numbers come back.
+COUNT_TS = ("awk '/Sending request to TS/ {a++} /Receiving response from TS/ {b++} "
+            "END {print \"MSP_COUNTS\", a+0, b+0}'")
+
+def read_command(inode, offset):
+    # Print where the log ends now and count the TS messages between the
+    # cursor and that point.  If the log was rotated the rest of the old
+    # file (now ddc_debug.log.1) is counted along with the new one.
+    return ('set -- $(stat -c \'%%i %%s\' %(log)s); echo "MSP_CURSOR $1 $2"; '
+            '{ if [ "$1" = "%(inode)s" ] && [ "$2" -ge %(offset)d ]; then '
+            'tail -c +%(start)d %(log)s | head -c $(($2 - %(offset)d)); '
+            'else if [ "$(stat -c %%i %(rotated)s 2>/dev/null)" = "%(inode)s" ]; then '
+            'tail -c +%(start)d %(rotated)s; fi; head -c $2 %(log)s; fi; } | %(count)s'
+            % {'log': DDC_LOG, 'rotated': DDC_LOG_ROTATED, 'inode': inode,
+               'offset': offset, 'start': offset + 1, 'count': COUNT_TS})
+
+# Seconds to wait for msp_tscollector.py to answer
+COLLECTOR_TIMEOUT = 5
+
+# Count TS requests and responses, from the collector if it follows the
+# server, else from the log.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname, minutes=5):
+    result = check_collector(hostname, int(minutes))
+    if result is None:
+        result = check_log(session, hostname)
+    return result
+
+# Ask msp_tscollector.py for the counts of the last minutes minutes.
+# Returns None when no collector is following the server.
+def check_collector(hostname, minutes):
+    path = msp_session.collector_socket()
+    if path is None:
+        return None
+    try:
+        reply = msp_session.unix_request(path, {'op': 'counts', 'hostname': hostname, 'minutes': minutes},
+                                         COLLECTOR_TIMEOUT)
+    except (msp_session.BrokerUnavailable, pexpect.TIMEOUT, pexpect.EOF):
+        return None
+    if 'error' in reply:
+        return None
+    command12a_cnt = reply['requests']
+    command12b_cnt = reply['responses']
+    unanswered = max(command12a_cnt - command12b_cnt, 0)
+    
+    if command12a_cnt == 0 or command12b_cnt == 0 or unanswered > UNANSWERED_MAX:
+        command12_resp = 'WARNING: %s requests sent to TS; %s responses from TS in the last %d seconds' % (command12a_cnt, command12b_cnt, reply['span'])
+        command12_exit = 1
+    else:
+        command12_resp = 'OK: %s requests sent to TS; %s responses from TS in the last %d seconds' % (command12a_cnt, command12b_cnt, reply['span'])
+        command12_exit = 0
+    if not reply['complete']:
+        # the tail started or was restarted within those seconds
+        command12_resp += ' (incomplete: %d of them followed)' % (reply['seconds'])
+    command12_out = 'requests=%s;;;0 responses=%s;;;0 unanswered_ratio=%.3f;;;0;1' % (
+        command12a_cnt, command12b_cnt, float(unanswered) / max(command12a_cnt, 1))
+    
+    return command12_resp, command12_exit, command12_out
+
+# Count TS requests and responses written to ddc_debug.log.0 since the
+# last run.
+def check_log(session, hostname):
+    # The cursor is the inode and size of the log at the last run.  Only
+    # the bytes written since then are read, and on the first run nothing.
+    cursor = msp_session.load_state('cursors', hostname + '-ddc_debug')
+    if cursor is None:
+        command12_tmp = session.run("stat -c 'MSP_CURSOR %%i %%s' %s" % (DDC_LOG))
+    else:
+        command12_tmp = session.run(read_command(cursor['inode'], cursor['offset']))
+    now = time.time()
+    
+    m = re.search('MSP_CURSOR (\d+) (\d+)', command12_tmp)
+    if m is None:
+        return 'UNKNOWN: could not read %s' % (DDC_LOG), 3, None
+    new_cursor = {'inode': m.group(1), 'offset': int(m.group(2)), 'time': now}
+    if cursor is None:
+        msp_session.save_state('cursors', hostname + '-ddc_debug', new_cursor)
+        return 'OK: started reading %s; counts from the next run' % (DDC_LOG), 0, None
+    
+    m = re.search('MSP_COUNTS (\d+) (\d+)', command12_tmp)
+    if m is None:
+        # keep the old cursor so the next run counts this interval too
+        return 'UNKNOWN: could not count TS messages in %s' % (DDC_LOG), 3, None
+    msp_session.save_state('cursors', hostname + '-ddc_debug', new_cursor)
+    command12a_cnt = int(m.group(1))
+    command12b_cnt = int(m.group(2))
+    interval = max(now - cursor['time'], 1)
+    
+    if command12a_cnt == 0 or command12b_cnt == 0 or command12a_cnt - command12b_cnt > UNANSWERED_MAX:
+        command12_resp = 'WARNING: %s requests sent to TS; %s responses from TS in %d seconds' % (command12a_cnt, command12b_cnt, interval)
+        command12_exit = 1
+    else:
+        command12_resp = 'OK: %s requests sent to TS; %s responses from TS in %d seconds' % (command12a_cnt, command12b_cnt, interval)
+        command12_exit = 0
+    command12_out = 'requests=%s;;;0 responses=%s;;;0 requests_per_minute=%.2f;;;0 responses_per_minute=%.2f;;;0' % (
+        command12a_cnt, command12b_cnt, command12a_cnt * 60.0 / interval, command12b_cnt * 60.0 / interval)
+    
+    return command12_resp, command12_exit, command12_out
+
 def main():
     
     ######################################################################
@@ -57,7 +172,7 @@ def main():
     ######################################################################
     
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:', ['help','h','?'])
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:m:', ['help','h','?'])
     except Exception as e:
         print(str(e))
         exit_with_usage()
@@ -85,96 +200,22 @@ def main():
         password = options['-P']
     else:
         exit_with_usage()
-    
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: user@hostnamemsp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
+    minutes = int(options.get('-m', 5))
     
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    child.sendline('tail -24 /var/log/miep/ddc_debug.log.0')
-    time.sleep(2)
-    child.send('\003')
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Read ssh response, post-process and write data to the csv file
-    command12_tmp = child.before
-    command12a_cnt = command12_tmp.count('Sending request to TS')
-    command12b_cnt = command12_tmp.count('Receiving response from TS')
-    
-    if command12a_cnt == 8 and command12b_cnt == 8:
-        command12_resp = 'OK: %s requests sent to TS; %s responses from TS' % (command12a_cnt, command12b_cnt)
-        command12_exit = 0
-    elif command12a_cnt < 8 or command12b_cnt < 8:
-        command12_resp = 'WARNING: %s requests sent to TS; %s responses from TS' % (command12a_cnt, command12b_cnt)
-        command12_exit = 1
+    command12_resp, command12_exit, command12_tmp = check(session, hostname, minutes)
     
     # Send the results to Nagios
     ##################################################################
-    print('%s | %s' % (command12_resp, command12_tmp))
-    sys.exit(command12_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command12_resp, command12_exit, command12_tmp, session)
     
 if __name__ == "__main__":
     main()
@@ -34,6 +34,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +50,37 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Check the usage of /dev/sda1 with df.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # Issue command via ssh; the one output is parsed for the status and
+    # also sent along as the long output.
+    command01_out = session.run('df -kh')
+    
+    # Read ssh response
+    m = re.search('\/dev\/sda1\s+\d+\w\s+\d*.?\d?\w\s+\d+.?\d?\w?\s+(\d+)%', command01_out)
+    if m is None:
+        command01_resp = 'UNKNOWN: /dev/sda1 not found in df output'
+        command01_exit = 3
+    else:
+        command01_tmp = m.groups()
+        # Convert the tuple to an int
+        command01_tmp = ''.join(command01_tmp)
+        command01_tmp = int(command01_tmp)
+        
+        # Post-process data
+        if command01_tmp < 80:
+            command01_resp = 'OK: /dev/sda1 is at %s percent' % (command01_tmp)
+            command01_exit = 0
+        if command01_tmp >= 80:
+            command01_resp = 'WARNING: /dev/sda1 is at %s percent' % (command01_tmp)
+            command01_exit = 1
+        if command01_tmp >= 90:
+            command01_resp = 'CRITICAL: /dev/sda1 is at %s percent' % (command01_tmp)
+            command01_exit = 2
+    
+    return command01_resp, command01_exit, command01_out
+
 def main():
     
     ######################################################################
@@ -85,106 +117,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: user@hostnamemsp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    # Issue command via ssh
-    child.sendline('df -kh')
-    
-    # Read ssh response
-    child.expect('\/dev\/sda1\s+\d+\w\s+\d*.?\d?\w\s+\d+.?\d?\w?\s+(\d+)%')
-    command01_tmp = child.match.groups()
-    # Convert the tuple to an int
-    command01_tmp = ''.join(command01_tmp)
-    command01_tmp = int(command01_tmp)
-    
-    # Post-process data
-    if command01_tmp < 80:
-        command01_resp = 'OK: /dev/sda1 is at %s percent' % (command01_tmp)
-        command01_exit = 0
-    if command01_tmp >= 80:
-        command01_resp = 'WARNING: /dev/sda1 is at %s percent' % (command01_tmp)
-        command01_exit = 1
-    if command01_tmp >= 90:
-        command01_resp = 'CRITICAL: /dev/sda1 is at %s percent' % (command01_tmp)
-        command01_exit = 2
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Issue command via ssh.
-    child.sendline('df -kh')
-    child.expect(COMMAND_PROMPT)
-    
-    # Read ssh response, post-process and write data to the csv file
-    command01_out = child.before
+    command01_resp, command01_exit, command01_out = check(session, hostname)
     
     # Send the results to Nagios
-    print('%s | %s' % (command01_resp,command01_out))
-    sys.exit(command01_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command01_resp, command01_exit, command01_out, session)
     
 if __name__ == "__main__":
     main()
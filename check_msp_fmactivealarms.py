@@ -34,6 +34,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +50,167 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Most alarms listed in the long output; the perfdata has the full counts
+LONG_OUTPUT_LINES = 200
+
+# One 'Field              : value' line of an alarm
+FIELD_LINE = re.compile(r'^\s*([^:]+?)\s*:\s?(.*)$')
+# Terminal control sequences the shell mixes into the output
+TERMINAL_CONTROL = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+# What fmactivealarms says when nothing is active
+NO_ALARMS = re.compile(r'(?i)\bno (active )?alarms\b|\balarms\b[^:]*:\s*0\s*$')
+
+FMACTIVEALARMS = '/appl/esa/bin/fmactivealarms'
+# Echoed after the command with its exit status, the marker split so the
+# echo of the command line never matches it
+STATUS_MARKER = 'MSP_FMSTATUS'
+STATUS_LINE = re.compile(r'^%s (\d+)\s*$' % (STATUS_MARKER))
+
+# Alarm fields kept in a record (id, severity, source, raised), by the
+# lower case field name; the rest of an alarm's lines are only counted.
+RECORD_FIELDS = {
+    'alarm id': 0,
+    'severity': 1,
+    'resource id': 2,
+    'source': 2,
+    'timestamp': 3,
+    'event time': 3,
+}
+
+
+class AlarmParser(object):
+    """Reads fmactivealarms output piece by piece as it arrives.
+
+    Alarms are blocks of 'Field : value' lines separated by blank lines.
+    Only running severity counts and an (id, severity, source, raised)
+    tuple per alarm are kept, never the whole output.  status is the exit
+    status of fmactivealarms once its STATUS_MARKER line has been read.
+    """
+
+    def __init__(self):
+        self.counts = {'critical': 0, 'major': 0, 'minor': 0}
+        self.alarms = []
+        self.alarm = [None] * 4
+        self.partial = ''
+        self.status = None
+        self.no_alarms = False
+
+    def feed(self, data):
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            self.line(line.rstrip('\r'))
+
+    def line(self, line):
+        line = TERMINAL_CONTROL.sub('', line)
+        m = STATUS_LINE.match(line)
+        if m is not None:
+            self.end_alarm()
+            self.status = int(m.group(1))
+            return
+        if NO_ALARMS.search(line):
+            self.end_alarm()
+            self.no_alarms = True
+            return
+        m = FIELD_LINE.match(line)
+        if m is None:
+            # a blank or other line ends the alarm
+            self.end_alarm()
+            return
+        field, value = m.group(1).lower(), m.group(2).strip()
+        if field in RECORD_FIELDS:
+            self.alarm[RECORD_FIELDS[field]] = value
+        if field == 'severity' and value.lower() in self.counts:
+            self.counts[value.lower()] += 1
+
+    def end_alarm(self):
+        if self.alarm[1] is not None:
+            self.alarms.append(tuple(self.alarm))
+        self.alarm = [None] * 4
+
+    def close(self):
+        if self.partial:
+            self.line(self.partial.rstrip('\r'))
+            self.partial = ''
+        self.end_alarm()
+
+    def recognised(self):
+        # An alarm list, or fmactivealarms saying there is none; anything
+        # else (no output, an error message) says nothing about the alarms.
+        return bool(self.alarms) or self.no_alarms
+
+def alarm_key(alarm):
+    # The alarm id names an alarm; without one the whole record does.
+    if alarm[0]:
+        return alarm[0]
+    return '|'.join([field or '' for field in alarm])
+
+def alarm_line(change, alarm):
+    alarm_id, severity, source, raised = [field or '-' for field in alarm]
+    return '%s %s alarm %s on %s raised %s' % (change, severity, alarm_id, source, raised)
+
+def load_snapshot(hostname):
+    alarms = msp_session.load_state('alarms', hostname)
+    if alarms is None:
+        return None
+    return [tuple(alarm) for alarm in alarms]
+
+# Count the active alarms by severity and list those raised or cleared
+# since the last run.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # Issue command via ssh; the output is parsed as it arrives instead of
+    # being collected first.
+    parser = AlarmParser()
+    session.stream("%s; echo '%s''%s' $?" % (FMACTIVEALARMS, STATUS_MARKER[:6], STATUS_MARKER[6:]),
+                   parser.feed)
+    parser.close()
+    
+    # Output that is not an alarm list says nothing about which alarms were
+    # raised or cleared: the last snapshot is kept for the next good run.
+    if parser.status is None:
+        return 'UNKNOWN: fmactivealarms did not finish', 3, None
+    if parser.status != 0:
+        return 'UNKNOWN: fmactivealarms failed with exit status %s' % (parser.status), 3, None
+    if not parser.recognised():
+        return 'UNKNOWN: no alarm list in fmactivealarms output', 3, None
+    
+    command04_crit = parser.counts['critical']
+    command04_major = parser.counts['major']
+    command04_minor = parser.counts['minor']
+    
+    # Compare with the alarms of the last run; on the first run every
+    # alarm is new.
+    previous = load_snapshot(hostname) or []
+    current = set([alarm_key(alarm) for alarm in parser.alarms])
+    before = set([alarm_key(alarm) for alarm in previous])
+    command04_new = [alarm for alarm in parser.alarms if alarm_key(alarm) not in before]
+    command04_cleared = [alarm for alarm in previous if alarm_key(alarm) not in current]
+    msp_session.save_state('alarms', hostname, parser.alarms)
+    
+    if command04_crit > 0:
+        command04_resp = 'CRITICAL: %s critical alarms; %s major alarms; %s minor alarms' % (command04_crit,command04_major,command04_minor)
+        command04_exit = 2
+    elif command04_crit == 0 and command04_major > 0:
+        command04_resp = 'WARNING: %s critical alarms; %s major alarms; %s minor alarms' % (command04_crit,command04_major,command04_minor)
+        command04_exit = 1
+    elif command04_crit == 0 and command04_major == 0:
+        command04_resp = 'OK: %s critical alarms; %s major alarms; %s minor alarms' % (command04_crit,command04_major,command04_minor)
+        command04_exit = 0
+    command04_resp += '; %s new; %s cleared' % (len(command04_new), len(command04_cleared))
+    
+    # Perfdata, then one line per alarm raised or cleared since the last run
+    command04_out = 'critical=%s;;;0 major=%s;;;0 minor=%s;;;0 new=%s;;;0 cleared=%s;;;0' % (
+        command04_crit, command04_major, command04_minor, len(command04_new), len(command04_cleared))
+    changes = [alarm_line('NEW', alarm) for alarm in command04_new[:LONG_OUTPUT_LINES]]
+    changes += [alarm_line('CLEARED', alarm) for alarm in command04_cleared[:LONG_OUTPUT_LINES - len(changes)]]
+    if changes:
+        command04_out += '\n' + '\n'.join(changes)
+    if len(command04_new) + len(command04_cleared) > len(changes):
+        command04_out += '\n... and %s more' % (len(command04_new) + len(command04_cleared) - len(changes))
+    
+    return command04_resp, command04_exit, command04_out
+
 def main():
     
     ######################################################################
@@ -85,99 +247,20 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
-    
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
-            
-    # Issue command via ssh
-    child.sendline('/appl/esa/bin/fmactivealarms')
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
     
-    # Read ssh response, post-process and write data to the csv file
-    command04_tmp = child.before
-    command04_crit = command04_tmp.count('Severity           : critical')
-    command04_major = command04_tmp.count('Severity           : major')
-    command04_minor = command04_tmp.count('Severity           : minor')
-    
-    if command04_crit > 0:
-        command04_resp = 'CRITICAL: %s critical alarms; %s major alarms; %s minor alarms' % (command04_crit,command04_major,command04_minor)
-        command04_exit = 2
-    elif command04_crit == 0 and command04_major > 0:
-        command04_resp = 'WARNING: %s critical alarms; %s major alarms; %s minor alarms' % (command04_crit,command04_major,command04_minor)
-        command04_exit = 1
-    elif command04_crit == 0 and command04_major == 0:
-        command04_resp = 'OK: %s critical alarms; %s major alarms; %s minor alarms' % (command04_crit,command04_major,command04_minor)
-        command04_exit = 0
+    command04_resp, command04_exit, command04_tmp = check(session, hostname)
     
     # Send the results to Nagios
     ##################################################################
-    print('%s | %s' % (command04_resp,command04_tmp))
-    sys.exit(command04_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command04_resp, command04_exit, command04_tmp, session)
     
 if __name__ == "__main__":
     main()
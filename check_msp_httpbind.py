@@ -35,6 +35,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -50,6 +51,28 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Fetch www.google.com with wget bound to remaddr.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname, remaddr):
+    # Issue command together with the clean up of the 'wget-log*' files left
+    # behind by wget, in one round trip.  One try with a timeout means wget
+    # always exits by itself, so no Ctrl-C is needed when the bind fails.
+    results = session.run_many(['wget --tries=1 --timeout=10 -O /dev/null --bind-address=%s http://www.google.com' % (remaddr),
+                                '/bin/rm -f /home/miepadm/wget-log*'])
+    command05a_tmp = results[0][0]
+    
+    # Read ssh response
+    if '200 OK' in command05a_tmp:
+        command05a_resp = 'OK: Bind test to google.com passed'
+        command05a_exit = 0
+        command05a_out = command05a_tmp
+    else:
+        command05a_resp = 'WARNING: Bind test to google.com failed'
+        command05a_exit = 1
+        command05a_out = 'Connecting to www.google.com (www.google.com)|172.217.5.100|:80'
+    
+    return command05a_resp, command05a_exit, command05a_out
+
 def main():
     
     ######################################################################
@@ -90,102 +113,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    # Issue command
-    child.sendline('wget --bind-address=%s http://www.google.com' % (remaddr))
-    
-    # Read ssh response
-    i = child.expect(['failed: Cannot assign requested address', '200 OK', pexpect.TIMEOUT])
-    if i == 0:
-        child.sendcontrol('C')
-        child.expect(COMMAND_PROMPT, timeout=15)
-        command05a_resp = 'WARNING: Bind test to google.com failed'
-        command05a_exit = 1
-        command05a_out = 'Connecting to www.google.com (www.google.com)|172.217.5.100|:80'
-    if i == 1:
-        command05a_resp = 'OK: Bind test to google.com passed'
-        command05a_exit = 0
-        child.expect(COMMAND_PROMPT)
-        command05a_out = child.before
-    if i == 2:
-        command05a_resp = 'WARNING: Bind test to google.com failed'
-        command05a_exit = 1
-        command05a_out = 'Connecting to www.google.com (www.google.com)|172.217.5.100|:80'
-        pass
-    
-    # Delete 'wget-log*' files left behind by wget.
-    child.sendline('/bin/rm /home/miepadm/wget-log*')
-    child.expect(COMMAND_PROMPT)
+    command05a_resp, command05a_exit, command05a_out = check(session, hostname, remaddr)
     
     # Send the results to Nagios
-    print('%s | %s' % (command05a_resp,command05a_out))
-    sys.exit(command05a_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command05a_resp, command05a_exit, command05a_out, session)
     
 if __name__ == "__main__":
     main()
@@ -34,6 +34,8 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_inventory
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +51,48 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Count the interfaces that are UP against the number expected for the host.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # Expected interfaces from the host's role
+    command03_expect = msp_inventory.get(hostname, 'interfaces')
+    if command03_expect is None:
+        return 'UNKNOWN: no interface count for %s in %s' % (hostname, msp_inventory.path()), 3, None
+    command03_expect = int(command03_expect)
+    # The command listing them: the role's, else sudo where the host's probe
+    # found it allowed, else ifconfig as the user
+    command03_cmd = msp_inventory.get(hostname, 'ifconfig')
+    if command03_cmd is None:
+        capabilities = msp_session.capabilities(session)
+        if 'ifconfig' in capabilities['sudo']:
+            # -n makes sudo fail at once instead of prompting for the root password
+            command03_cmd = 'sudo -n ifconfig -a'
+        elif 'ifconfig' in capabilities['commands']:
+            command03_cmd = '%s -a' % (capabilities['commands']['ifconfig'])
+        else:
+            return 'UNKNOWN: no ifconfig on %s' % (hostname), 3, None
+        
+    # Issue command via ssh
+    command03_tmp = session.run(command03_cmd)
+    
+    if 'password is required' not in command03_tmp:
+        # Read ssh response, post-process and write data to the csv file
+        command03_cnt = command03_tmp.count(' UP BROADCAST ')
+        if command03_cnt == command03_expect:
+            command03_resp = 'OK: %s interfaces UP' % (command03_cnt)
+            command03_exit = 0
+        else:
+            command03_resp = 'WARNING: %s interfaces UP' % (command03_cnt)
+            command03_exit = 1
+    else:
+        # sudo was taken away since the probe; probe again next time
+        msp_session.forget_capabilities(session)
+        command03_resp = 'Command failed'
+        command03_tmp = 'Requires root password'
+        command03_exit = 2
+    
+    return command03_resp, command03_exit, command03_tmp
+
 def main():
     
     ######################################################################
@@ -85,133 +129,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
-    
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    if 'hostname02mspadm' in hostname or 'hostname04mspadm' in hostname or 'hostname05mspadm' in hostname:
-        command03_expect = 8
-    if 'hostname03mspadm' in hostname:
-        command03_expect = 8
-    if 'hostname02msp1da' in hostname or 'hostname02msp2da' in hostname:
-        command03_expect = 8
-    if 'hostname03msp1da' in hostname or 'hostname03msp2da' in hostname:
-        command03_expect = 8
-    if 'hostname04msp1da' in hostname or 'hostname04msp2da' in hostname:
-        command03_expect = 8
-    if 'hostname05msp1da' in hostname or 'hostname05msp2da' in hostname:
-        command03_expect = 8
-    if 'msp1ddc' in hostname or 'msp2ddc' in hostname:
-        command03_expect = 7
-    if 'hostname02mspmn' in hostname or 'hostname03mspmn' in hostname:
-        command03_expect = 9
-    if 'hostname04mspmn' in hostname:
-        command03_expect = 9
-    if 'hostname05mspmn' in hostname:
-        command03_expect = 6
-    if 'hostname02mspmon' in hostname:
-        command03_expect = 8
-    if 'hostname03mspmon' in hostname or 'hostname04mspmon' in hostname or 'hostname05mspmon' in hostname:
-        command03_expect = 8
-    if 'hostname02msp1ts' in hostname:
-        command03_expect = 14
-    if 'hostname03msp1ts' in hostname or 'hostname04msp1ts' in hostname or 'hostname05msp1ts' in hostname:
-        command03_expect = 15
-    if 'mspvmt' in hostname:
-        command03_expect = 6
-    if 'hostname05' in hostname or 'mspvmt' in hostname:
-        command03_cmd = '/sbin/ifconfig -a'
-    else:
-        command03_cmd = 'sudo ifconfig -a'
-        
-    # Issue command via ssh
-    child.sendline('%s' % (command03_cmd))
-    
-    # Wait for the command prompt before proceeding
-    i = child.expect([COMMAND_PROMPT, 'root.s\spassword:', pexpect.TIMEOUT])
-    if i == 0:
-        # Read ssh response, post-process and write data to the csv file
-        command03_tmp = child.before
-        command03_cnt = command03_tmp.count(' UP BROADCAST ')
-        if command03_cnt == command03_expect:
-            command03_resp = 'OK: %s interfaces UP' % (command03_cnt)
-            command03_exit = 0
-        else:
-            command03_resp = 'WARNING: %s interfaces UP' % (command03_cnt)
-            command03_exit = 1
-    if i == 1:
-        child.send('\003')
-        child.expect(COMMAND_PROMPT)
-        command03_resp = 'Command failed'
-        command03_tmp = 'Requires root password'
-        command03_exit = 2
+    command03_resp, command03_exit, command03_tmp = check(session, hostname)
     
     # Send the results to Nagios
-    print('%s | %s' % (command03_resp,command03_tmp))
-    sys.exit(command03_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command03_resp, command03_exit, command03_tmp, session)
     
 if __name__ == "__main__":
     main()
@@ -35,6 +35,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -50,6 +51,27 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Test a TCP connection to the MMSC from remaddr.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname, remaddr):
+    # -z makes nc close the connection as soon as it is established and -w
+    # bounds the connect attempt, so nc always exits by itself.
+    command05b_cmd = 'nc -4 -v -z -w 15 -s %s mmsc.mobile.att.net 80' % (remaddr)
+    
+    # Issue command; the one output is parsed for the status and also
+    # sent along as the long output.
+    command05b_out = session.run(command05b_cmd, timeout=20)
+    
+    # Read ssh response
+    if re.search('\[tcp\/http\] succeeded\!', command05b_out):
+        command05b_resp = 'OK: Connectivity test to MMSC passed'
+        command05b_exit = 0
+    else:
+        command05b_resp = 'CRITICAL: Connectivity test to MMSC failed'
+        command05b_exit = 2
+    
+    return command05b_resp, command05b_exit, command05b_out
+
 def main():
     
     ######################################################################
@@ -90,104 +112,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    try:
-        # Issue command
-        child.sendline('nc -4 -v -s %s mmsc.mobile.att.net 80' % (remaddr))
-        
-        # Read ssh response
-        child.expect('\[tcp\/http\] succeeded\!',timeout=15)
-        # Escape the session
-        time.sleep(2)
-        child.sendcontrol('C')
-    except pexpect.TIMEOUT:
-        command05b_resp = 'CRITICAL: Connectivity test to MMSC failed'
-        command05b_exit = 2
-        pass
-    else:
-        command05b_resp = 'OK: Connectivity test to MMSC passed'
-        command05b_exit = 0
-        
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Issue command via ssh - run it a second time until we figure out how to capture the
-    # command output and parse the output with one command.
-    child.sendline('nc -4 -v -s %s mmsc.mobile.att.net 80' % (remaddr))
-    time.sleep(2)
-    child.sendcontrol('C')
-    child.expect(COMMAND_PROMPT)
-    command05b_out = child.before
+    command05b_resp, command05b_exit, command05b_out = check(session, hostname, remaddr)
     
     # Send the results to Nagios
-    print('%s | %s' % (command05b_resp,command05b_out))
-    sys.exit(command05b_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command05b_resp, command05b_exit, command05b_out, session)
     
 if __name__ == "__main__":
     main()
@@ -22,18 +22,27 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 # 02110-1301, USA.
 # 
-# python check_msp_mnapps.py [-H hostname] [-A ipaddress] [-U username] [-P password]
+# python check_msp_mnapps.py [-H hostname] [-A ipaddress] [-U username] [-P password] [-S] [-c command file] [-s service]
 #     -H <hostname>               Remote server's hostname
 #     -A <ipaddress>              Remote server's IP address
 #     -U <username>               SSH username for the Remote server
 #     -P <password>               SSH password for the Remote server
+#     -S                          Also submit a passive check result per MNapps service
+#     -c <command file>           Nagios command file used with -S
+#     -s <service>                Service description of each MNapps service, %s
+#                                 being its name (default 'MNapps %s')
 # 
+# The result is the aggregate over all MNapps services, with one line per
+# service in the long output.  With -S each service's own result is also
+# submitted to Nagios, all from the one 'mnapps status'.
 # 
 
 from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_inventory
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +58,87 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# The '● name.service - Description' line that starts a service's status;
+# only a unit name ending in .service, at most a bullet before it
+SERVICE_LINE = re.compile(r'^\W{0,4}?([\w@:.-]+)\.service(?:\s+-\s.*)?\s*$')
+# Its '   Active: active (running) since ...' line
+ACTIVE_LINE = re.compile(r'^\s*Active:\s*(\S+)(?:\s+\(([^)]*)\))?')
+
+def services(text):
+    # Parse 'mnapps status' into [(service, active, sub), ...], as in
+    # ('mnapps-foo', 'active', 'running').
+    # An Active: line is the state of the last unit header above it; one
+    # without a header of its own is still counted, with service None.
+    records = []
+    service = None
+    for line in text.splitlines():
+        m = ACTIVE_LINE.match(line)
+        if m is not None:
+            records.append((service, m.group(1), m.group(2) or ''))
+            service = None
+            continue
+        m = SERVICE_LINE.match(line)
+        if m is not None:
+            service = m.group(1)
+    return records
+
+# One Nagios result per named MNapps service, as [(service, resp, exit), ...].
+# A record without a name has no Nagios service to go to; it only counts
+# in the host's result.
+def check_services(records):
+    results = []
+    for service, active, sub in records:
+        if service is None:
+            continue
+        if active == 'active':
+            results.append((service, 'OK: %s is %s (%s)' % (service, active, sub), 0))
+        else:
+            results.append((service, 'WARNING: %s is %s (%s)' % (service, active, sub), 1))
+    return results
+
+def collect(session):
+    # Issue command via ssh; the whole status, piped so no pager is started
+    return services(session.run('/opt/miep/tools/mnapps status | cat'))
+
+# Count the MNapps services in Active state.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    return check_records(hostname, collect(session))
+
+# The aggregate result of the parsed services, then one line per service.
+def check_records(hostname, records):
+    # MNapps services expected in Active state, from the host's role
+    command01_expect = msp_inventory.get(hostname, 'mnapps')
+    if command01_expect is None:
+        return 'UNKNOWN: no MNapps service count for %s in %s' % (hostname, msp_inventory.path()), 3, None
+    command01_expect = int(command01_expect)
+    
+    command01_cnt = len([record for record in records if record[1] == 'active'])
+    command01_down = [service or '(unnamed)' for service, active, sub in records if active != 'active']
+    command01_unnamed = [(active, sub) for service, active, sub in records if service is None]
+    if command01_cnt >= command01_expect and not command01_down and not command01_unnamed:
+        command01_resp = 'OK: All %s MNapps services are in Active state' % (command01_cnt)
+        command01_exit = 0
+    elif command01_cnt >= command01_expect and not command01_down:
+        # all active, but some states were read without their service's name
+        command01_resp = 'UNKNOWN: %s MNapps services are in Active state' % (command01_cnt)
+        command01_exit = 3
+    else:
+        command01_resp = 'WARNING: %s MNapps services are in Active state' % (command01_cnt)
+        command01_exit = 1
+    if command01_down:
+        command01_resp += '; not active: %s' % (', '.join(command01_down))
+    if command01_unnamed:
+        command01_resp += '; %s without a service name' % (len(command01_unnamed))
+    
+    command01_out = 'active=%s;;;0 services=%s;;;0' % (command01_cnt, len(records))
+    for service, resp, exit in check_services(records):
+        command01_out += '\n' + resp
+    for active, sub in command01_unnamed:
+        command01_out += '\nUNKNOWN: service without a name is %s (%s)' % (active, sub)
+    
+    return command01_resp, command01_exit, command01_out
+
 def main():
     
     ######################################################################
@@ -56,7 +146,7 @@ def main():
     ######################################################################
     
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:', ['help','h','?'])
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:Sc:s:', ['help','h','?'])
     except Exception as e:
         print(str(e))
         exit_with_usage()
@@ -85,92 +175,25 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    # Issue command via ssh
-    child.sendline('%s' % ('/opt/miep/tools/mnapps status | grep -B2 -i active | grep -v loaded'))
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
+    records = collect(session)
+    command01_resp, command01_exit, command01_tmp = check_records(hostname, records)
     
-    # Read ssh response, post-process and write data to the csv file
-    command01_tmp = child.before
-    command01_cnt = command01_tmp.count('Active: active')
-    if command01_cnt == 9:
-        command01_resp = 'OK: All %s MNapps services are in Active state' % (command01_cnt)
-        command01_exit = 0
-    else:
-        command01_resp = 'WARNING: %s MNapps services are in Active state' % (command01_cnt)
-        command01_exit = 1
+    if '-S' in options:
+        for service, resp, exit in check_services(records):
+            msp_session.submit_passive(hostname, options.get('-s', 'MNapps %s') % (service),
+                                       exit, resp, None, options.get('-c'))
     
     # Send the results to Nagios
-    print('%s | %s' % (command01_resp,command01_tmp))
-    sys.exit(command01_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command01_resp, command01_exit, command01_tmp, session)
     
 if __name__ == "__main__":
     main()
@@ -22,18 +22,26 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 # 02110-1301, USA.
 # 
-# python check_msp_nsctrl.py [-H hostname] [-A ipaddress] [-U username] [-P password]
+# python check_msp_nsctrl.py [-H hostname] [-A ipaddress] [-U username] [-P password] [-S] [-c command file] [-s service]
 #     -H <hostname>               Remote server's hostname
 #     -A <ipaddress>              Remote server's IP address
 #     -U <username>               SSH username for the Remote server
 #     -P <password>               SSH password for the Remote server
+#     -S                          Also submit a passive check result per process
+#     -c <command file>           Nagios command file used with -S
+#     -s <service>                Service description of each process, %s
+#                                 being its name (default 'nsctrl %s')
 # 
+# Hosts whose role lists processes in the inventory (msp_inventory.ini) must
+# have those Running; on any other host every process listed must be Running.
 # 
 
 from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_inventory
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +57,79 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# A row of 'nsctrl status': the process state, two or more spaces, then the
+# process name, e.g. '...  Running                  Diameter Agent'.  The
+# name's words are one space apart; two or more end the column, and any
+# columns after it are not part of the name.
+PROCESS_LINE = re.compile(r'^.*?\b([A-Z][a-z]+(?:ing|ed))[ \t]{2,}(\S+(?: \S+)*)', re.M)
+
+NO_PROCESSES = 'UNKNOWN: no processes in nsctrl status output'
+
+def processes(text):
+    # Parse 'nsctrl status' into [(process, state), ...]
+    return [(m.group(2), m.group(1)) for m in PROCESS_LINE.finditer(text)]
+
+def collect(session):
+    # Issue command via ssh
+    return processes(session.run('nsctrl status'))
+
+# One Nagios result per process, as [(process, resp, exit), ...]: the ones
+# the host's role expects, or every process listed if it expects none.
+def check_processes(hostname, rows):
+    states = dict(rows)
+    expected = msp_inventory.get_list(hostname, 'processes')
+    if not rows:
+        # nothing read says nothing about the processes
+        return [(process, NO_PROCESSES, 3) for process in expected]
+    if not expected:
+        expected = [process for process, state in rows]
+    results = []
+    for process in expected:
+        state = states.get(process, 'missing')
+        if state == 'Running':
+            results.append((process, 'OK: %s Running' % (process), 0))
+        else:
+            results.append((process, 'WARNING: %s %s' % (process, state), 1))
+    return results
+
+# Check the processes listed by 'nsctrl status'.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    return check_rows(hostname, collect(session))
+
+# The overall result of the parsed rows, then one line per process.
+def check_rows(hostname, rows):
+    if not rows:
+        return NO_PROCESSES, 3, None
+    results = check_processes(hostname, rows)
+    states = dict(rows)
+    command02_down = ['%s (%s)' % (process, states.get(process, 'missing'))
+                      for process, resp, exit in results if exit != 0]
+    command02a_cnt = len(results) - len(command02_down)
+    
+    if msp_inventory.get_list(hostname, 'processes'):
+        if not command02_down:
+            command02_resp = 'OK: %s %s Running' % (command02a_cnt, command02a_cnt == 1 and 'process' or 'processes')
+            command02_exit = 0
+        else:
+            command02_resp = 'WARNING: %s of %s processes not Running: %s' % (
+                len(command02_down), len(results), ', '.join(command02_down))
+            command02_exit = 1
+    else:
+        if not command02_down:
+            command02_resp = 'OK: %s processes Running; %s processes Stopped' % (command02a_cnt, 0)
+            command02_exit = 0
+        else:
+            command02_resp = 'WARNING: %s processes Running; %s processes Stopped: %s' % (
+                command02a_cnt, len(command02_down), ', '.join(command02_down))
+            command02_exit = 1
+    
+    command02_out = 'running=%s;;;0 stopped=%s;;;0' % (command02a_cnt, len(command02_down))
+    for process, resp, exit in results:
+        command02_out += '\n' + resp
+    
+    return command02_resp, command02_exit, command02_out
+
 def main():
     
     ######################################################################
@@ -56,7 +137,7 @@ def main():
     ######################################################################
     
     try:
-        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:', ['help','h','?'])
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?H:A:U:P:Sc:s:', ['help','h','?'])
     except Exception as e:
         print(str(e))
         exit_with_usage()
@@ -85,133 +166,25 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    # Issue command via ssh
-    child.sendline('nsctrl status')
+    rows = collect(session)
+    command02_resp, command02_exit, command02_tmp = check_rows(hostname, rows)
     
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Read ssh response, post-process
-    command02_tmp = child.before
-    if 'hostname02msp1da' in hostname or 'hostname02msp2da' in hostname:
-        command02a_cnt = command02_tmp.count('Running                  Diameter Agent')
-        if command02a_cnt == 1:
-            command02_resp = 'OK: 1 process Running'
-            command02_exit = 0
-        else:
-            command02_resp = 'WARNING: 1 process Stopped'
-            command02_exit = 1
-    
-    elif 'hostname03msp1da' in hostname or 'hostname03msp2da' in hostname:
-        command02a_cnt = command02_tmp.count('Running                  Diameter Agent')
-        command02b_cnt = command02_tmp.count('Running                  Traffic Regulator')
-        if command02a_cnt == 1 and command02b_cnt == 1:
-            command02_resp = 'OK: 2 processes Running'
-            command02_exit = 0
-        else:
-            command02_resp = 'WARNING: 1 or more processes Stopped'
-            command02_exit = 1
-    
-    elif 'hostname04msp1da' in hostname or 'hostname04msp2da' in hostname:
-        command02a_cnt = command02_tmp.count('Running                  Diameter Agent')
-        if command02a_cnt == 1:
-            command02_resp = 'OK: 1 process Running'
-            command02_exit = 0
-        else:
-            command02_resp = 'WARNING: 1 process Stopped'
-            command02_exit = 1
-    
-    elif 'hostname05msp1da' in hostname or 'hostname05msp2da' in hostname:
-        command02a_cnt = command02_tmp.count('Running                  Diameter Agent')
-        command02b_cnt = command02_tmp.count('Running                  Traffic Regulator')
-        if command02a_cnt == 1 and command02b_cnt == 1:
-            command02_resp = 'OK: 2 processes Running'
-            command02_exit = 0
-        else:
-            command02_resp = 'WARNING: 1 or more processes Stopped'
-            command02_exit = 1
-    
-    else:
-        command02a_cnt = command02_tmp.count('unning')
-        command02b_cnt = command02_tmp.count('topped')
-        command02_resp = '%s processes Running; %s processes Stopped' % (command02a_cnt,command02b_cnt)
-        if command02b_cnt == 0:
-            command02_resp = 'OK: %s processes Running; %s processes Stopped' % (command02a_cnt,command02b_cnt)
-            command02_exit = 0
-        else:
-            command02_resp = 'WARNING: %s processes Running; %s processes Stopped' % (command02a_cnt,command02b_cnt)
-            command02_exit = 1
+    if '-S' in options:
+        for process, resp, exit in check_processes(hostname, rows):
+            msp_session.submit_passive(hostname, options.get('-s', 'nsctrl %s') % (process),
+                                       exit, resp, None, options.get('-c'))
     
     # Send the results to Nagios
-    print('%s | %s' % (command02_resp,command02_tmp))
-    sys.exit(command02_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command02_resp, command02_exit, command02_tmp, session)
     
 if __name__ == "__main__":
     main()
@@ -34,6 +34,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +50,27 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Resolve www.google.com with nslookup.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # Issue command together with the clean up of the 'index.html' file left
+    # behind by nslookup, in one round trip.  The first output is parsed for
+    # the status and also sent along as the long output.
+    results = session.run_many(['nslookup www.google.com', '/bin/rm -f /home/miepadm/index.html*'])
+    command05c_out = results[0][0]
+    
+    # Read ssh response
+    m = re.search('Name:\s+www.google.com\r?\nAddress:\s(\d{1,3}.\d{1,3}.\d{1,3}.\d{1,3})', command05c_out)
+    if m is None:
+        command05c_resp = 'WARNING: nslookup test failed'
+        command05c_exit = 1
+    else:
+        command05c_temp = m.groups()
+        command05c_resp = 'OK: nslookup to %s passed' % (command05c_temp)
+        command05c_exit = 0
+    
+    return command05c_resp, command05c_exit, command05c_out
+
 def main():
     
     ######################################################################
@@ -85,106 +107,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
-    
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    try:
-        # Issue command
-        child.sendline('nslookup www.google.com')
-        
-        # Read ssh response
-        child.expect('Name:\s+www.google.com\r\nAddress:\s(\d{1,3}.\d{1,3}.\d{1,3}.\d{1,3})',timeout=5)
-        command05c_temp = child.match.groups()
-    except pexpect.TIMEOUT:
-        command05c_resp = 'WARNING: nslookup test failed'
-        command05c_exit = 1
-        pass
-    else:
-        command05c_resp = 'OK: nslookup to %s passed' % (command05c_temp)
-        command05c_exit = 0
-    
-    # Wait for the command prompt before proceeding
-    time.sleep(2)
-    child.expect(COMMAND_PROMPT)
-    
-    # Issue command via ssh - run it a second time until we figure out how to capture the
-    # command output and parse the output with one command.
-    child.sendline('nslookup www.google.com')
-    time.sleep(2)
-    child.expect(COMMAND_PROMPT)
-    command05c_out = child.before
+    command05c_resp, command05c_exit, command05c_out = check(session, hostname)
     
-    # Delete 'index.html' file left behind by nslookup.
-    child.sendline('/bin/rm /home/miepadm/index.html*')
-    child.expect(COMMAND_PROMPT)
-
     # Send the results to Nagios
-    print('%s | %s' % (command05c_resp,command05c_out))
-    sys.exit(command05c_exit)
-    
-    # Now exit the remote host.
-    child.sendline('exit')
+    msp_session.report(command05c_resp, command05c_exit, command05c_out, session)
     
 if __name__ == "__main__":
     main()
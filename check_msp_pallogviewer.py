@@ -5,6 +5,10 @@
 # in the troubleshooter log on Ericsson MSP servers and
 # sends the results to Nagios.
 #
+# The count of today's alarms is kept per host in
+# /var/tmp/msp_plugins/cursors, and each run only reads the part of the log
+# written since the last one.
+#
 # Written by Alan Sendgikoski <asendgi@gmail.com>
 # 
 # Licence : GNU General Public Licence (GPL) http://www.gnu.org/
@@ -35,6 +39,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -50,6 +55,70 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+TROUBLESHOOTER_LOG = '/var/log/miep/troubleshooter_log.xml'
+
+# Full scan of today's part of the log, used to start the running count
+ALARMS_TODAY = ("""pallogviewer -10 -d "type==alarm&&date>=$(date +%%Y'-'%%m'-'%%d)" %s"""
+                % (TROUBLESHOOTER_LOG))
+
+# Log entries of type alarm, as written in the XML; matched on the server.
+# Anchored on both sides, so subtype="alarm" and type="alarmClear" are not
+# counted, the same as pallogviewer's type==alarm.
+COUNT_ALARMS = ("awk 'tolower($0) ~ /(^|[^a-z0-9_])type[\">= ]+alarm([^a-z0-9_]|$)/ {n++} "
+                "END {print \"MSP_COUNTS\", n+0}'")
+
+# Prints the log's inode and size and the server's date
+CURSOR = ('set -- $(stat -c \'%%i %%s\' %s); echo "MSP_CURSOR $1 $2 $(date +%%F)"'
+          % (TROUBLESHOOTER_LOG))
+
+def read_command(inode, offset):
+    # Count the alarms written between the cursor and the end of the log
+    # as it is now; nothing is counted if the log was rotated or truncated.
+    return ('%(cursor)s; if [ "$1" = "%(inode)s" ] && [ "$2" -ge %(offset)d ]; then '
+            'tail -c +%(start)d %(log)s | head -c $(($2 - %(offset)d)) | %(count)s; fi'
+            % {'cursor': CURSOR, 'log': TROUBLESHOOTER_LOG, 'inode': inode,
+               'offset': offset, 'start': offset + 1, 'count': COUNT_ALARMS})
+
+# Count today's alarms in the troubleshooter log.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # The running count of today's alarms is kept with a cursor (inode, size
+    # and the server's date at the last run), so only the entries added since
+    # then are looked at.  The first run, a new day and a rotated log start
+    # the count again with a full pallogviewer scan.
+    state = msp_session.load_state('cursors', hostname + '-troubleshooter')
+    command09_tmp = None
+    if state is not None:
+        output = session.run(read_command(state['inode'], state['offset']))
+        cursor = re.search('MSP_CURSOR (\d+) (\d+) (\S+)', output)
+        counts = re.search('MSP_COUNTS (\d+)', output)
+        if cursor is None:
+            return 'UNKNOWN: could not read %s' % (TROUBLESHOOTER_LOG), 3, None
+        if counts is None or cursor.group(3) != state['day']:
+            state = None
+    if state is None:
+        # Issue command via ssh.  The cursor is taken before the scan, so an
+        # alarm written while it runs is counted again rather than never.
+        command09_tmp = session.run('%s; %s' % (CURSOR, ALARMS_TODAY))
+        cursor = re.search('MSP_CURSOR (\d+) (\d+) (\S+)', command09_tmp)
+        if cursor is None:
+            return 'UNKNOWN: could not read %s' % (TROUBLESHOOTER_LOG), 3, None
+        command09_cnt = command09_tmp.count('Type    = alarm')
+    else:
+        command09_cnt = state['count'] + int(counts.group(1))
+    msp_session.save_state('cursors', hostname + '-troubleshooter',
+                           {'inode': cursor.group(1), 'offset': int(cursor.group(2)),
+                            'day': cursor.group(3), 'count': command09_cnt})
+    
+    if command09_cnt == 0:
+        command09_resp = 'OK: %s logs of Type = alarm' % (command09_cnt)
+        command09_exit = 0
+    else:
+        command09_resp = 'WARNING: %s logs of Type = alarm' % (command09_cnt)
+        command09_exit = 1
+    
+    return command09_resp, command09_exit, command09_tmp
+
 def main():
     
     ######################################################################
@@ -86,93 +155,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
-    
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    # Issue command via ssh
-    child.sendline('''pallogviewer -10 -d "type==alarm&&date>=$(date +%Y'-'%m'-'%d)" /var/log/miep/troubleshooter_log.xml''')
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Read ssh response, post-process and write data to the csv file
-    command09_tmp = child.before
-    command09_cnt = command09_tmp.count('Type    = alarm')
-    
-    if command09_cnt == 0:
-        command09_resp = 'OK: %s logs of Type = alarm' % (command09_cnt)
-        command09_exit = 0
-    else:
-        command09_resp = 'WARNING: %s logs of Type = alarm' % (command09_cnt)
-        command09_exit = 1
+    command09_resp, command09_exit, command09_tmp = check(session, hostname)
     
     # Send the results to Nagios
-    print('%s | %s' % (command09_resp,command09_tmp))
-    sys.exit(command09_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command09_resp, command09_exit, command09_tmp, session)
     
 if __name__ == "__main__":
     main()
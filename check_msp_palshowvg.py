@@ -34,6 +34,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -49,6 +50,38 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Compare the VG current and total counts from palshowvg.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname):
+    # Issue command; the one output is parsed for the status and also
+    # sent along as the long output.
+    command07_out = session.run('palshowvg -l all')
+    
+    # Read ssh response and post-process
+    m = re.search('===VG\sCurrent\sCount\[(\d+)\],\sTotal\sCount\[(\d+)\]', command07_out)
+    if 'command not found' in command07_out:
+        command07_resp = 'WARNING: Command not found.'
+        command07_exit = 1
+    elif m is not None:
+        command07_curr,command07_totl = m.groups()
+        if command07_curr == command07_totl:
+            command07_resp = 'OK: VG Current Count = %s Total Count = %s' % (command07_curr,command07_totl)
+            command07_exit = 0
+        else:
+            command07_resp = 'WARNING: VG Current Count = %s Total Count = %s' % (command07_curr,command07_totl)
+            command07_exit = 1
+    elif 'There is no valid data.' in command07_out:
+        command07_resp = 'WARNING: The service tcpproxy is not running. There is no valid data.'
+        command07_exit = 1
+    elif 'There is no valid VG data.' in command07_out:
+        command07_resp = 'WARNING: The service tcpproxy is not running. There is no valid VG data.'
+        command07_exit = 1
+    else:
+        command07_resp = 'UNKNOWN: Unexpected palshowvg output.'
+        command07_exit = 3
+    
+    return command07_resp, command07_exit, command07_out
+
 def main():
     
     ######################################################################
@@ -85,108 +118,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    # Issue command
-    child.sendline('palshowvg -l all')
-    
-    # Read ssh response and post-process
-    i = child.expect(['command not found', '===VG\sCurrent\sCount\[(\d+)\],\sTotal\sCount\[(\d+)\]', 'There is no valid data.', 'There is no valid VG data.', pexpect.TIMEOUT])
-    if i == 0:
-        command07_resp = 'WARNING: Command not found.'
-        command07_exit = 1
-    if i == 1:
-        command07_curr,command07_totl = child.match.groups()
-        if command07_curr == command07_totl:
-            command07_resp = 'OK: VG Current Count = %s Total Count = %s' % (command07_curr,command07_totl)
-            command07_exit = 0
-        else:
-            command07_resp = 'WARNING: VG Current Count = %s Total Count = %s' % (command07_curr,command07_totl)
-            command07_exit = 1
-    if i == 2:
-        command07_resp = 'WARNING: The service tcpproxy is not running. There is no valid data.'
-        command07_exit = 1
-    if i == 3:
-        command07_resp = 'WARNING: The service tcpproxy is not running. There is no valid VG data.'
-        command07_exit = 1
-    
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Issue command via ssh - run it a second time until we figure out how to capture the
-    # command output and parse the output with one command.
-    child.sendline('palshowvg -l all')
-    child.expect(COMMAND_PROMPT)
-    command07_out = child.before
+    command07_resp, command07_exit, command07_out = check(session, hostname)
     
     # Send the results to Nagios
-    print('%s | %s' % (command07_resp,command07_out))
-    sys.exit(command07_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command07_resp, command07_exit, command07_out, session)
     
 if __name__ == "__main__":
     main()
@@ -42,6 +42,7 @@ from __future__ import absolute_import
 import csv
 import datetime
 import getopt
+import msp_session
 import os
 import pexpect
 import re
@@ -57,6 +58,27 @@ def exit_with_usage():
     print(globals()['__doc__'])
     os._exit(1)
 
+# Check that port is in LISTEN state according to netstat.
+# Returns the (resp, exit, out) triple sent to Nagios.
+def check(session, hostname, port):
+    # Issue command; the one output is parsed for the status and also
+    # sent along as the long output.
+    command06a_out = session.run('netstat -an | grep %s' % (port))
+    
+    # Read ssh response, Post-process resp
+    command06a_port = re.findall(':(\d{4})\s+.+\s+LISTEN', command06a_out)
+    if not command06a_port:
+        command06a_resp = 'WARNING: Port not open'
+        command06a_exit = 1
+    elif port in command06a_port:
+        command06a_resp = 'OK: Port %s in LISTEN state' % (port)
+        command06a_exit = 0
+    else:
+        command06a_resp = 'WARNING: Port %s not open' % (port)
+        command06a_exit = 1
+    
+    return command06a_resp, command06a_exit, command06a_out
+
 def main():
     
     ######################################################################
@@ -97,106 +119,19 @@ def main():
     else:
         exit_with_usage()
     
-    # Some constants
-    # This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
-    SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
-    CONN_REFUSED = 'Connection refused'
-    #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
-    # sample command prompt: hostname02msp1ai01:~> 
-    COMMAND_PROMPT = hostname + ':~>\s'
-    
     # Set variables
     critical = 5000.0
     warning = 3000.0
     
     # SSH to server
-    child = pexpect.spawn('/usr/bin/ssh %s@%s' % (username, ipaddress))
-    
-    # uncomment the following line for debugging
-    #child.logfile = sys.stdout
+    session = msp_session.connect(hostname, ipaddress, username, password)
     
-    i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, COMMAND_PROMPT, '(?i)password'], timeout=2)
-    if i == 0: # Connection refused
-        command_resp = 'CRITICAL: connection refused'
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 1: # Timeout
-        command_resp =('CRITICAL: could not login with SSH.')
-        command_exit = 2
-        print('%s' % (command_resp))
-        sys.exit('command_exit')
-        # Now exit the remote host.
-        child.sendline('exit')
-    if i == 2: # In this case SSH does not have the public key cached.
-        child.sendline('yes')
-        child.expect('(?i)password')
-        child.sendline(password)
-        # Now we are at the command prompt.
-        child.expect(COMMAND_PROMPT)
-        time.sleep(1)
-    if i == 3:
-        # This may happen if a public key was setup to automatically login.
-        # But beware, the COMMAND_PROMPT at this point is very trivial and
-        # could be fooled by some output in the MOTD or login message.
-        pass
-    if i == 4:
-        child.sendline(password)
-        # Now we are at the command prompt.
-        i = child.expect(['[Pp]assword: ', COMMAND_PROMPT])
-        if i == 0:
-            # password prompt again, probably because the password was not accepted
-            command_resp = 'CRITICAL: permission denied; possible invalid password.'
-            command_exit = 2
-            print('%s' % (command_resp))
-            sys.exit('command_exit')
-            # Now exit the remote host.
-            child.sendline('exit')
-        if i == 1:
-            pass
-
-    time.sleep(2)
-
     # Now we should be at the command prompt and ready to run some commands.
     
-    try:
-        # Issue command
-        child.sendline('netstat -an | grep %s' % (port))
-        
-        # Read ssh response, Post-process resp
-        child.expect(':(\d{4})\s+.+\s+LISTEN',timeout=1)
-        command06a_port = child.match.groups()
-    except pexpect.TIMEOUT:
-        command06a_resp = 'WARNING: Port not open'
-        command06a_exit = 1
-        pass
-    else:
-        if port in command06a_port:
-            command06a_resp = 'OK: Port %s in LISTEN state' % (port)
-            command06a_exit = 0
-        else:
-            command06a_resp = 'WARNING: Port %s not open' % (port)
-            command06a_exit = 1
-            
-    # Wait for the command prompt before proceeding
-    child.expect(COMMAND_PROMPT)
-    
-    # Issue command via ssh - run it a second time until we figure out how to capture the
-    # command output and parse the output with one command.
-    child.sendline('netstat -an | grep %s' % (port))
-    child.expect(COMMAND_PROMPT)
-    
-    # Read ssh response, post-process and write data to the csv file
-    command06a_out = child.before
+    command06a_resp, command06a_exit, command06a_out = check(session, hostname, port)
     
     # Send the results to Nagios
-    print('%s | %s' % (command06a_resp,command06a_out))
-    sys.exit(command06a_exit)
-    
-    # Now exit the remote host.
-    child.sendline ('exit')
+    msp_session.report(command06a_resp, command06a_exit, command06a_out, session)
     
 if __name__ == "__main__":
     main()
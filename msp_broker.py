@@ -0,0 +1,280 @@
+#!/usr/local/bin/python2.7
+# -*- coding: UTF-8 -*-
+#
+# Session broker for the Ericsson MSP Nagios plugins.  Keeps logged-in SSH
+# sessions to the MSP servers and runs the plugins' commands on them, so a
+# check costs only the remote command's runtime instead of a login.
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# $ python msp_broker.py [-s socket] [-n sessions] [-k keepalive] [-i idle]
+#     -s <socket>                 Unix socket to listen on
+#                                 (default /var/tmp/msp_plugins/broker.sock)
+#     -n <sessions>               Commands in flight per host (default 2)
+#     -k <keepalive>              Seconds between keepalives on idle sessions (default 60)
+#     -i <idle>                   Seconds before an idle session is logged out (default 900)
+#
+# Run it as the Nagios user, from the init system, next to Nagios.  The
+# check_msp_* scripts find the socket by themselves, so their command lines
+# stay the same.
+#
+# Each request is one line of JSON, answered with one line of JSON:
+#     {"op": "login", "run" or "run_many", "hostname": ..., "ipaddress": ...,
+#      "username": ..., "password": ..., "command": ..., "commands": [...], "timeout": ...}
+#     {"output": ..., "results": [[output, status], ...], "login_time": ...}
+#     or  {"error": ..., "exit": ...}
+#
+
+from __future__ import absolute_import
+import getopt
+import json
+import msp_session
+import os
+import pexpect
+import signal
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+def exit_with_usage():
+
+    print(globals()['__doc__'])
+    os._exit(1)
+
+class HostPool(object):
+    """Logged-in sessions to one host, at most limit of them busy at once."""
+
+    def __init__(self, hostname, ipaddress, username, password, limit):
+        self.hostname = hostname
+        self.ipaddress = ipaddress
+        self.username = username
+        self.password = password
+        self.slots = threading.Semaphore(limit)
+        self.lock = threading.Lock()
+        # idle sessions as (session, time last used)
+        self.idle = []
+
+    def checkout(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()[0]
+        session = msp_session.Session(self.hostname, self.ipaddress, self.username, self.password)
+        session.login()
+        return session
+
+    def checkin(self, session):
+        self.checkin_at(session, time.time())
+
+    def set_password(self, password):
+        # Never run a command for a caller that could not log in itself:
+        # sessions logged in with the old password are closed, the idle ones
+        # now and the busy ones when they are checked in.
+        with self.lock:
+            if password == self.password:
+                return
+            self.password = password
+            sessions, self.idle = self.idle, []
+        for session, last_used in sessions:
+            session.close()
+
+    def login(self):
+        self.slots.acquire()
+        try:
+            session = self.checkout()
+            self.checkin(session)
+            return session.login_time
+        finally:
+            self.slots.release()
+
+    def run(self, method, arg, timeout):
+        # method is 'run' (one command) or 'run_many' (a list of them)
+        self.slots.acquire()
+        try:
+            # An idle session may have been dropped by the server since it was
+            # last used; that shows up as EOF, so log in again and retry once.
+            for attempt in (1, 2):
+                session = self.checkout()
+                try:
+                    output = getattr(session, method)(arg, timeout=timeout)
+                except pexpect.EOF:
+                    session.close()
+                    if attempt == 2:
+                        raise
+                    continue
+                except pexpect.TIMEOUT:
+                    # the command may still be running; drop the shell
+                    session.close()
+                    raise
+                self.checkin(session)
+                return output
+        finally:
+            self.slots.release()
+
+    def maintain(self, keepalive, idle_timeout):
+        # Log out sessions idle too long and check the rest still answer.
+        now = time.time()
+        with self.lock:
+            sessions, self.idle = self.idle, []
+        for session, last_used in sessions:
+            if now - last_used >= idle_timeout:
+                session.close()
+                continue
+            if now - last_used >= keepalive:
+                try:
+                    session.sync()
+                except (pexpect.TIMEOUT, pexpect.EOF):
+                    session.close()
+                    continue
+            self.checkin_at(session, last_used)
+
+    def checkin_at(self, session, last_used):
+        with self.lock:
+            if session.password == self.password:
+                self.idle.append((session, last_used))
+                return
+        session.close()
+
+    def close(self):
+        with self.lock:
+            sessions, self.idle = self.idle, []
+        for session, last_used in sessions:
+            session.close()
+
+
+class Broker(object):
+
+    def __init__(self, limit, keepalive, idle_timeout):
+        self.limit = limit
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.pools = {}
+
+    def pool(self, request):
+        key = (request['hostname'], request['ipaddress'], request['username'])
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = HostPool(request['hostname'], request['ipaddress'], request['username'],
+                                request['password'], self.limit)
+                self.pools[key] = pool
+        pool.set_password(request['password'])
+        return pool
+
+    def handle(self, request):
+        pool = self.pool(request)
+        try:
+            if request['op'] == 'login':
+                return {'login_time': pool.login()}
+            timeout = request.get('timeout', msp_session.COMMAND_TIMEOUT)
+            if request['op'] == 'run_many':
+                return {'results': pool.run('run_many', request['commands'], timeout)}
+            return {'output': pool.run('run', request['command'], timeout)}
+        except msp_session.SessionError as e:
+            return {'error': e.resp, 'exit': e.exit}
+        except pexpect.TIMEOUT:
+            return {'exception': 'TIMEOUT', 'output': 'command timed out'}
+        except pexpect.EOF:
+            return {'exception': 'EOF', 'output': 'connection closed'}
+
+    def maintain(self):
+        while True:
+            time.sleep(min(self.keepalive, self.idle_timeout))
+            with self.lock:
+                pools = list(self.pools.values())
+            for pool in pools:
+                pool.maintain(self.keepalive, self.idle_timeout)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError:
+            reply = {'error': 'UNKNOWN: bad request to session broker', 'exit': msp_session.STATE_UNKNOWN}
+        else:
+            reply = self.server.broker.handle(request)
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+class BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+
+    ######################################################################
+    ## Parse the options, arguments, get ready, etc.
+    ######################################################################
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?s:n:k:i:', ['help','h','?'])
+    except Exception as e:
+        print(str(e))
+        exit_with_usage()
+    options = dict(optlist)
+    if len(args) > 0:
+        exit_with_usage()
+
+    if [elem for elem in options if elem in ['-h','--h','-?','--?','--help']]:
+        print("Help:")
+        exit_with_usage()
+
+    if '-s' in options:
+        path = options['-s']
+    else:
+        path = msp_session.setting('BROKER_SOCKET') or os.path.join(msp_session.state_dir(), msp_session.BROKER_SOCKET)
+    limit = int(options.get('-n', 2))
+    keepalive = int(options.get('-k', 60))
+    idle_timeout = int(options.get('-i', 900))
+
+    # The requests carry passwords, so only the owner may use the socket.
+    os.umask(0o077)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = BrokerServer(path, RequestHandler)
+    server.broker = Broker(limit, keepalive, idle_timeout)
+
+    maintainer = threading.Thread(target=server.broker.maintain)
+    maintainer.daemon = True
+    maintainer.start()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+        for pool in list(server.broker.pools.values()):
+            pool.close()
+
+if __name__ == "__main__":
+    main()
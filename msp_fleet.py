@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+#
+# Script for running the MSP checks against many Ericsson MSP servers at
+# once from one process and sending the results to Nagios as passive
+# check results.  Needs Python 3 (asyncio).
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# $ python3 msp_fleet.py [-f host file] [-U username] [-P password] [-n concurrency] [-t timeout] [-c command file] [-p]
+#     -f <host file>              File listing the hosts and their checks
+#     -U <username>               SSH username for the Remote servers
+#     -P <password>               SSH password for the Remote servers
+#     -n <concurrency>            Hosts checked at the same time (default 20)
+#     -t <timeout>                Seconds allowed per host (default 120)
+#     -c <command file>           Nagios command file for the passive results
+#     -p                          Print the results instead of submitting them
+#
+# Each line of the host file is a hostname, its IP address and the checks to
+# run on it, written as for check_msp_batch.py -C:
+#
+#     hostname02msp1da01  10.1.1.21  disk,ifconfig,nsctrl,port:3868=MSP Port 3868
+#     hostname02msp1ddc01 10.1.1.31  disk,ddcserv,ddcstat
+#
+# Every host gets one SSH login for all of its checks.  Up to -n hosts are
+# worked on at once, so a sweep of the fleet takes about as long as the
+# slowest host rather than the sum of all of them.
+#
+
+import asyncio
+import concurrent.futures
+import getopt
+import os
+import sys
+import threading
+
+import check_msp_batch
+import msp_session
+
+
+def exit_with_usage():
+
+    print(globals()['__doc__'])
+    os._exit(1)
+
+def read_hosts(path):
+    hosts = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            hostname, ipaddress, spec = line.split(None, 2)
+            hosts.append((hostname, ipaddress, check_msp_batch.parse_checks(spec)))
+    return hosts
+
+def check_host(hostname, ipaddress, username, password, checks, sessions, begin, cancelled):
+    # Runs in a worker thread: one login, then the host's checks in turn.
+    # begin() starts the host's timeout.  The session is registered so a
+    # timed out host can be cut off, and once cancelled is set the worker
+    # neither logs in again nor starts another check.
+    begin()
+    try:
+        session = msp_session.open_cached(hostname, ipaddress, username, password)
+    except msp_session.SessionError as e:
+        return [(service, e.resp, e.exit, None) for name, args, service in checks]
+    sessions[hostname] = session
+    try:
+        if cancelled.is_set():
+            return []
+        return check_msp_batch.run_checks(session, hostname, checks, cancelled)
+    finally:
+        sessions.pop(hostname, None)
+        try:
+            session.close()
+        except Exception:
+            # the results are in; a session that will not close is no reason to lose them
+            pass
+
+async def sweep(hosts, username, password, concurrency, timeout):
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    sessions = {}
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+
+    async def one(hostname, ipaddress, checks):
+        async with limit:
+            # The clock starts when a worker thread takes the host, not while
+            # the job waits for one held by a host that timed out earlier.
+            begun = loop.create_future()
+            begin = lambda: loop.call_soon_threadsafe(begun.set_result, None)
+            cancelled = threading.Event()
+            work = loop.run_in_executor(executor, check_host, hostname, ipaddress,
+                                        username, password, checks, sessions,
+                                        begin, cancelled)
+            await begun
+            try:
+                results = await asyncio.wait_for(work, timeout)
+            except asyncio.TimeoutError:
+                # Closing the session ends the blocked expect in the worker.
+                cancelled.set()
+                session = sessions.pop(hostname, None)
+                if session is not None:
+                    getattr(session, 'cancel', session.close)()
+                resp = 'UNKNOWN: no result from %s within %s seconds' % (hostname, timeout)
+                results = [(service, resp, msp_session.STATE_UNKNOWN, None) for name, args, service in checks]
+            except Exception as e:
+                # Anything else that went wrong is this host's alone: its
+                # checks are UNKNOWN and the rest of the sweep goes on.
+                resp = 'UNKNOWN: checks of %s failed: %s' % (hostname, e.__class__.__name__)
+                results = [(service, resp, msp_session.STATE_UNKNOWN, None) for name, args, service in checks]
+            return hostname, results
+
+    try:
+        return await asyncio.gather(*[one(hostname, ipaddress, checks)
+                                      for hostname, ipaddress, checks in hosts])
+    finally:
+        executor.shutdown(wait=False)
+
+def main():
+
+    ######################################################################
+    ## Parse the options, arguments, get ready, etc.
+    ######################################################################
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?f:U:P:n:t:c:p', ['help','h','?'])
+    except Exception as e:
+        print(str(e))
+        exit_with_usage()
+    options = dict(optlist)
+    if len(args) > 0:
+        exit_with_usage()
+
+    if [elem for elem in options if elem in ['-h','--h','-?','--?','--help']]:
+        print("Help:")
+        exit_with_usage()
+
+    if '-f' in options:
+        hosts = read_hosts(options['-f'])
+    else:
+        exit_with_usage()
+    if '-U' in options:
+        username = options['-U']
+    else:
+        exit_with_usage()
+    if '-P' in options:
+        password = options['-P']
+    else:
+        exit_with_usage()
+    concurrency = int(options.get('-n', 20))
+    timeout = int(options.get('-t', 120))
+    command_file = options.get('-c')
+
+    results = asyncio.run(sweep(hosts, username, password, concurrency, timeout))
+
+    # Send the results to Nagios
+    counts = [0, 0, 0, 0]
+    for hostname, host_results in results:
+        for service, resp, exit, out in host_results:
+            counts[exit] += 1
+            if '-p' in options:
+                print('%s;%s;%s;%s' % (hostname, service, exit, resp))
+            else:
+                msp_session.submit_passive(hostname, service, exit, resp, out, command_file)
+    print('OK: %s hosts checked; %s OK; %s WARNING; %s CRITICAL; %s UNKNOWN'
+          % (len(results), counts[0], counts[1], counts[2], counts[3]))
+    sys.exit(msp_session.STATE_OK)
+
+if __name__ == "__main__":
+    main()
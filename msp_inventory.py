@@ -0,0 +1,153 @@
+#!/usr/local/bin/python2.7
+# -*- coding: UTF-8 -*-
+#
+# Host inventory of the Ericsson MSP Nagios plugins: what each server is
+# expected to have, by role.
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Usage from a plugin:
+#     import msp_inventory
+#     interfaces = msp_inventory.get(hostname, 'interfaces')
+#     processes = msp_inventory.get_list(hostname, 'processes')
+#
+# The inventory is msp_inventory.ini next to the plugins, or the file named
+# by MSP_INVENTORY.  It is an INI file with a [hosts] section giving the
+# role of each host and a [role <name>] section per role:
+#
+#     [DEFAULT]
+#     mnapps = 9
+#
+#     [hosts]
+#     hostname02msp1da = da
+#     *msp[12]ddc* = ddc
+#
+#     [role da]
+#     interfaces = 8
+#     processes = Diameter Agent
+#
+# A host is looked up by its hostname without the domain, then by that
+# hostname without its trailing number, then against the glob patterns in
+# the order they are listed.  The answer is remembered, so each host is
+# resolved once per process.  Values in [DEFAULT] apply to every role and
+# to hosts that have none.  The file is read once and read again only when
+# it changes, so long-running runners can keep it.
+#
+
+from __future__ import absolute_import
+import fnmatch
+import os
+import re
+import threading
+
+import msp_session
+
+try:
+    import configparser
+except ImportError:
+    import ConfigParser as configparser
+
+INVENTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'msp_inventory.ini')
+
+ROLE_SECTION = 'role '
+
+
+class Inventory(object):
+    """Roles and their expectations, indexed by hostname."""
+
+    def __init__(self, path):
+        self.path = path
+        parser = configparser.RawConfigParser()
+        parser.read(path)
+        self.defaults = dict(parser.defaults())
+        self.roles = {}
+        for section in parser.sections():
+            if section.startswith(ROLE_SECTION):
+                self.roles[section[len(ROLE_SECTION):].strip()] = dict(parser.items(section))
+        # exact names and names less their number, then glob patterns
+        self.hosts = {}
+        self.patterns = []
+        if parser.has_section('hosts'):
+            for name in parser.options('hosts'):
+                if name in self.defaults:
+                    continue
+                role = parser.get('hosts', name).strip()
+                if [c for c in name if c in '*?[']:
+                    self.patterns.append((name, role))
+                else:
+                    self.hosts[name] = role
+        self.lock = threading.Lock()
+        self.resolved = {}
+
+    def role(self, hostname):
+        """Return the role of hostname, or None when it has none."""
+        name = hostname.split('.')[0].lower()
+        with self.lock:
+            if name in self.resolved:
+                return self.resolved[name]
+        role = self.hosts.get(name)
+        if role is None:
+            role = self.hosts.get(re.sub(r'\d*$', '', name))
+        if role is None:
+            for pattern, pattern_role in self.patterns:
+                if fnmatch.fnmatchcase(name, pattern):
+                    role = pattern_role
+                    break
+        with self.lock:
+            self.resolved[name] = role
+        return role
+
+    def get(self, hostname, key, default=None):
+        """Return the value of key for hostname's role, or default."""
+        values = self.roles.get(self.role(hostname), self.defaults)
+        return values.get(key, default)
+
+    def get_list(self, hostname, key):
+        """Return the comma separated value of key for hostname as a list."""
+        return [item.strip() for item in self.get(hostname, key, '').split(',') if item.strip()]
+
+
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+def path():
+    return msp_session.setting('INVENTORY', INVENTORY_FILE)
+
+def load():
+    """Return the inventory, parsing the file only when it has changed."""
+    inventory_path = path()
+    try:
+        mtime = os.stat(inventory_path).st_mtime
+    except OSError:
+        mtime = None
+    with _inventories_lock:
+        loaded = _inventories.get(inventory_path)
+        if loaded is None or loaded[0] != mtime:
+            loaded = (mtime, Inventory(inventory_path))
+            _inventories[inventory_path] = loaded
+    return loaded[1]
+
+def role(hostname):
+    return load().role(hostname)
+
+def get(hostname, key, default=None):
+    return load().get(hostname, key, default)
+
+def get_list(hostname, key):
+    return load().get_list(hostname, key)
@@ -0,0 +1,1393 @@
+#!/usr/local/bin/python2.7
+# -*- coding: UTF-8 -*-
+#
+# Shared SSH session layer used by the Ericsson MSP Nagios plugins.
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# Usage from a plugin:
+#     import msp_session
+#     session = msp_session.connect(hostname, ipaddress, username, password)
+#     output = session.run('df -kh')
+#     results = session.run_many(['df -kh', 'uptime'])   # [(output, status), ...]
+#     session.close()
+#
+# Set MSP_SSH_DEBUG=1 in the environment to copy the SSH conversation to
+# stdout and report the login time on stderr.
+#
+# Set MSP_SSH_MULTIPLEX=1 to share one SSH connection per host between plugin
+# runs through an OpenSSH ControlMaster.  The first run for a host logs in and
+# leaves a master connection behind in MSP_SSH_CONTROL_DIR (default
+# /var/tmp/msp_plugins/ssh); later runs reuse it without a new TCP connect,
+# key exchange or password.  The master exits after MSP_SSH_CONTROL_PERSIST
+# seconds without a client (default 600).
+#
+# When msp_broker.py is running, plugins hand their commands to it over its
+# Unix socket (MSP_BROKER_SOCKET, default /var/tmp/msp_plugins/broker.sock)
+# and the broker runs them on a session it keeps logged in.  If the socket is
+# missing or dead the plugin logs in itself as usual.
+#
+# MSP_SSH_TRANSPORT picks how commands reach the server:
+#     shell     /usr/bin/ssh under a pseudo-terminal, commands typed into the
+#               remote shell (the default)
+#     exec      each command on its own non-interactive exec channel: no
+#               pseudo-terminal, no echo and no prompt matching, and stdout,
+#               stderr and the exit status come back separately.  The
+#               password login is done once to start an OpenSSH master in
+#               MSP_SSH_CONTROL_DIR, which the commands then go through.
+#               MSP_SSH_EXEC=1 is the same as MSP_SSH_TRANSPORT=exec.
+#     paramiko  exec channels from an in-process SSH client (needs the
+#               paramiko module); no ssh process is forked, and one
+#               connection per host is shared by every session in the process.
+# All of them offer login(), run(), run_many(), stream(), sync(), close() and
+# logged_in(); exec and paramiko also offer execute().
+#
+# Output of the read-only commands listed in CACHE_TTLS is kept in
+# /var/tmp/msp_plugins/cache, and a check that runs the same command on the
+# same host within its TTL is answered from there without logging in.
+# Nagios retries of a service in a soft state (NAGIOS_SERVICEATTEMPT > 1)
+# and runs with MSP_CACHE_BYPASS=1 always go to the server.  MSP_CACHE=0
+# turns the cache off and MSP_CACHE_SIZE bounds it in bytes.  Checks that
+# want the same cacheable command on the same host at the same time share
+# one run of it: the first takes a lock in /var/tmp/msp_plugins/flight and
+# the others wait for the output it stores.
+#
+# At most MSP_LOGIN_LIMIT logins (default 4) to one host are in progress at
+# once across all plugin runs on the poller; others queue for up to
+# MSP_LOGIN_WAIT seconds (default 30) and then report UNKNOWN, so a burst of
+# checks cannot trip sshd's MaxStartups on an MSP node.
+#
+# After MSP_BREAKER_FAILURES connects in a row to a host fail (default 3),
+# its checks return UNKNOWN at once, without trying, for MSP_BREAKER_RESET
+# seconds (default 300).  Then one check probes the host; if it gets in, all
+# checks go back to normal.
+#
+# capabilities() finds out once per host which of the PROBE_COMMANDS exist
+# and where, which may be run with sudo -n and which shell answers, and keeps
+# that in /var/tmp/msp_plugins/probes for MSP_PROBE_TTL seconds (default a
+# day), so checks run the command that works on the first try.
+#
+
+from __future__ import absolute_import
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import random
+import select
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pexpect
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
+
+# Nagios exit codes
+STATE_OK = 0
+STATE_WARNING = 1
+STATE_CRITICAL = 2
+STATE_UNKNOWN = 3
+# Order in which results decide an overall state, mildest first
+SEVERITY = [STATE_OK, STATE_UNKNOWN, STATE_WARNING, STATE_CRITICAL]
+
+# This is the prompt we get if SSH does not have the remote host's public key stored in the cache.
+SSH_NEWKEY = '[Aa]re you sure you want to continue connecting \(yes/no\)\?'
+CONN_REFUSED = 'Connection refused'
+PASSWORD_PROMPT = '(?i)password'
+PASSWORD_AGAIN = '[Pp]assword: '
+
+SSH_PROGRAM = '/usr/bin/ssh'
+
+# Nagios external command file used for passive check results
+NAGIOS_COMMAND_FILE = '/usr/local/nagios/var/rw/nagios.cmd'
+
+# pexpect hands back bytes on Python 3 unless it is given an encoding
+if sys.version_info[0] >= 3:
+    ENCODING = 'utf-8'
+else:
+    ENCODING = None
+
+LOGIN_TIMEOUT = 2
+COMMAND_TIMEOUT = 30
+
+# Local state shared between plugin runs (control sockets, caches, ...)
+STATE_DIR = '/var/tmp/msp_plugins'
+CONTROL_PERSIST = 600
+# How long a run waits for another run that is setting up the same master
+MASTER_LOCK_TIMEOUT = 30
+BROKER_SOCKET = 'broker.sock'
+TSCOLLECTOR_SOCKET = 'tscollector.sock'
+# Logins to one host that may be in progress at once across all plugin runs,
+# and how long a run queues for one before it gives up
+LOGIN_LIMIT = 4
+LOGIN_WAIT = 30
+# Failed connects in a row after which a host's checks fail fast, and the
+# seconds until one run is let through to probe it again
+BREAKER_FAILURES = 3
+BREAKER_RESET = 300
+# Exec channels run_many(parallel=True) opens at once on one host (sshd MaxSessions is 10)
+EXEC_CHANNELS = 8
+
+# Right after login the shell prompt is replaced by PROMPT_MARKER plus a
+# random token, so the end of every command is found with a plain string
+# search that MOTD text, the working directory or command output cannot
+# fool.  SYNC_MARKER plus a token is echoed back by the shell to show it is
+# reading commands.  Both are sent split in two quoted halves so the echo of
+# the command line itself never matches them.
+PROMPT_MARKER = 'MSP_PROMPT_'
+SYNC_MARKER = 'MSP_READY_'
+# Bracket each command sent by run_many(); the end marker carries $?
+BEGIN_MARKER = 'MSP_BEGIN_'
+END_MARKER = 'MSP_END_'
+
+# Seconds the output of a command may be reused, by the start of the
+# command.  Only commands that change nothing on the server belong here.
+CACHE_TTLS = [
+    ('/opt/miep/tools/ddc_tool processinfo', 60),
+    ('/opt/miep/tools/mnapps status', 60),
+    ('nsctrl status', 60),
+    ('df -kh', 60),
+    ('netstat -an', 60),
+    ('sudo -n ifconfig', 60),
+    ('/sbin/ifconfig', 60),
+    ('/usr/sbin/ifconfig', 60),
+    ('palshowvg', 300),
+]
+CACHE_SIZE = 4 * 1024 * 1024
+
+# Seconds a host's capability probe is trusted, the commands it looks for
+# (in PATH, /sbin and /usr/sbin) and those of them it tries with sudo -n
+PROBE_TTL = 86400
+PROBE_COMMANDS = ['ifconfig', 'ip', 'netstat', 'nslookup', 'nsctrl', 'pallogviewer',
+                  'palshowvg', 'fmactivealarms']
+PROBE_SUDO = ['ifconfig']
+
+
+class SessionError(Exception):
+    """The session could not be set up; resp and exit are what Nagios gets."""
+
+    def __init__(self, resp, exit=STATE_CRITICAL):
+        Exception.__init__(self, resp)
+        self.resp = resp
+        self.exit = exit
+
+
+class HostDown(SessionError):
+    """The host did not answer or refused the connection."""
+
+
+class BrokerUnavailable(Exception):
+    """No session broker is answering on the broker socket."""
+
+
+def worst(a, b):
+    """Return the more severe of two Nagios states."""
+    if SEVERITY.index(b) > SEVERITY.index(a):
+        return b
+    return a
+
+
+def setting(name, default=None):
+    """Return the MSP_<name> environment setting, or default when unset."""
+    return os.environ.get('MSP_' + name, default)
+
+
+def enabled(name):
+    return setting(name, '') not in ('', '0')
+
+
+def debug_enabled():
+    return enabled('SSH_DEBUG')
+
+
+def state_dir(*parts):
+    """Return a private directory under the plugin state directory, creating it."""
+    path = os.path.join(setting('STATE_DIR', STATE_DIR), *parts)
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return path
+
+
+def load_state(kind, name):
+    """Return what save_state() last stored for name, or None."""
+    try:
+        with open(os.path.join(state_dir(kind), name)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_state(kind, name, data):
+    """Keep data as JSON in the kind state directory under name.
+
+    The file is written under a temporary name and renamed into place, so a
+    run reading it at the same time never sees half of it.
+    """
+    path = os.path.join(state_dir(kind), name)
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp, path)
+
+
+def lock_file(path, timeout):
+    """Take an exclusive lock on path, waiting up to timeout seconds.
+
+    Returns the open lock file, to be given to unlock_file(), or None when
+    the lock could not be had in time.
+    """
+    f = open(path, 'a')
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+        if time.time() >= deadline:
+            f.close()
+            return None
+        time.sleep(0.05)
+
+
+def unlock_file(f):
+    if f is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+def login_slot(ipaddress):
+    """Take one of the host's MSP_LOGIN_LIMIT login slots for this run.
+
+    The slots are lock files shared by every plugin run on the poller, so a
+    host never sees more than the limit of logins at once.  Waits up to
+    MSP_LOGIN_WAIT seconds and returns the lock for unlock_file(); raises
+    SessionError when no slot frees up in time.
+    """
+    limit = int(setting('LOGIN_LIMIT', LOGIN_LIMIT))
+    if limit <= 0:
+        return None
+    wait = float(setting('LOGIN_WAIT', LOGIN_WAIT))
+    path = state_dir('slots', ipaddress)
+    slots = list(range(limit))
+    deadline = time.time() + wait
+    while True:
+        random.shuffle(slots)
+        for n in slots:
+            lock = lock_file(os.path.join(path, str(n)), 0)
+            if lock is not None:
+                return lock
+        if time.time() >= deadline:
+            raise SessionError('UNKNOWN: no login slot free for %s within %s seconds' % (ipaddress, wait),
+                               STATE_UNKNOWN)
+        # random back-off so queued runs do not all retry in step
+        time.sleep(random.uniform(0.05, 0.25))
+
+
+class CircuitBreaker(object):
+    """Failed connects to one host, shared by every plugin run on the poller.
+
+    After MSP_BREAKER_FAILURES connects in a row fail, logins to the host
+    fail fast with UNKNOWN for MSP_BREAKER_RESET seconds instead of each
+    waiting out its own timeout.  Then one run is let through as a probe
+    while the others keep failing fast; its success closes the breaker and
+    its failure opens it for another period.
+    """
+
+    def __init__(self, ipaddress):
+        self.ipaddress = ipaddress
+        self.path = os.path.join(state_dir('breaker'), ipaddress)
+        self.failures = int(setting('BREAKER_FAILURES', BREAKER_FAILURES))
+        self.reset = int(setting('BREAKER_RESET', BREAKER_RESET))
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'failures': 0, 'opened': 0}
+
+    def check(self):
+        """Raise SessionError while the breaker is open.
+
+        Returns the probe lock, to be given to unlock_file(), when this run
+        is the half-open probe, else None.
+        """
+        if self.failures <= 0:
+            return None
+        state = self.read()
+        if state['failures'] < self.failures:
+            return None
+        left = state['opened'] + self.reset - time.time()
+        if left <= 0:
+            probe = lock_file(self.path + '.probe', 0)
+            if probe is not None:
+                return probe
+            left = 0
+        raise SessionError('UNKNOWN: not checked, %s did not answer the last %d logins '
+                           '(host problem); next try in %d seconds'
+                           % (self.ipaddress, state['failures'], int(left)), STATE_UNKNOWN)
+
+    def failed(self):
+        lock = lock_file(self.path + '.lock', MASTER_LOCK_TIMEOUT)
+        try:
+            state = self.read()
+            state['failures'] += 1
+            if state['failures'] >= self.failures:
+                state['opened'] = time.time()
+            tmp = '%s.%d.tmp' % (self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.rename(tmp, self.path)
+        finally:
+            unlock_file(lock)
+
+    def succeeded(self):
+        if os.path.exists(self.path):
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def guard(self, login):
+        """Call login() unless the breaker is open, and record how it went."""
+        probe = self.check()
+        try:
+            result = login()
+        except HostDown:
+            self.failed()
+            raise
+        finally:
+            unlock_file(probe)
+        self.succeeded()
+        return result
+
+
+def partial_marker(data, marker):
+    """Return where the longest end of data that begins marker starts.
+
+    That is len(data) when data cannot end in the first part of marker.
+    """
+    for start in range(max(len(data) - len(marker) + 1, 0), len(data)):
+        if marker.startswith(data[start:]):
+            return start
+    return len(data)
+
+
+class Session(object):
+    """Interactive SSH shell on a remote MSP server, driven through pexpect."""
+
+    def __init__(self, hostname, ipaddress, username, password, prompt=None,
+                 newkey_password=PASSWORD_PROMPT, login_timeout=LOGIN_TIMEOUT,
+                 shell=True, logfile=None):
+        self.hostname = hostname
+        self.ipaddress = ipaddress
+        self.username = username
+        self.password = password
+        #COMMAND_PROMPT = '~\]\#\s' # use this when testing as root
+        # sample command prompt: user@hostnamemsp1ai01:~>
+        # Only used to see that the login worked; any working directory will do.
+        if prompt is None:
+            prompt = hostname + ':[^\r\n]*>\s'
+        self.prompt = prompt
+        # the exact prompt set after login, see set_prompt()
+        self.marker = None
+        self.newkey_password = newkey_password
+        self.login_timeout = login_timeout
+        # False for devices such as the HP OA whose CLI is not a Unix shell
+        self.shell = shell
+        if logfile is None and debug_enabled():
+            logfile = sys.stdout
+        self.logfile = logfile
+        self.child = None
+        self.login_time = None
+        if enabled('SSH_MULTIPLEX'):
+            # an absolute MSP_SSH_CONTROL_DIR replaces the default location
+            control_dir = state_dir(setting('SSH_CONTROL_DIR', 'ssh'))
+            self.control_path = os.path.join(control_dir, '%s@%s' % (username, ipaddress))
+        else:
+            self.control_path = None
+
+    def spawn_command(self):
+        if self.control_path is None:
+            return '%s %s@%s' % (SSH_PROGRAM, self.username, self.ipaddress)
+        return ('%s -o ControlMaster=auto -o ControlPath=%s -o ControlPersist=%s %s@%s'
+                % (SSH_PROGRAM, self.control_path, setting('SSH_CONTROL_PERSIST', CONTROL_PERSIST),
+                   self.username, self.ipaddress))
+
+    def login(self):
+        """Open the connection and authenticate; raise SessionError on failure."""
+        return CircuitBreaker(self.ipaddress).guard(self._limited_login)
+
+    def _limited_login(self):
+        lock = None
+        if self.control_path is not None and not os.path.exists(self.control_path):
+            # Only one run sets up the master for a host.  The others wait
+            # here and then find its socket and connect through it.
+            lock = lock_file(self.control_path + '.lock', MASTER_LOCK_TIMEOUT)
+        try:
+            slot = login_slot(self.ipaddress)
+            try:
+                return self._login()
+            finally:
+                unlock_file(slot)
+        finally:
+            unlock_file(lock)
+
+    def _login(self):
+        start = time.time()
+        child = pexpect.spawn(self.spawn_command(), encoding=ENCODING, codec_errors='replace')
+        child.logfile = self.logfile
+        self.child = child
+
+        i = child.expect([CONN_REFUSED, pexpect.TIMEOUT, SSH_NEWKEY, self.prompt, PASSWORD_PROMPT,
+                          pexpect.EOF], timeout=self.login_timeout)
+        if i == 0: # Connection refused
+            self.close()
+            raise HostDown('CRITICAL: connection refused')
+        if i == 1: # Timeout
+            self.close()
+            raise HostDown('CRITICAL: could not login with SSH.')
+        if i == 5: # ssh exited: no route to host, MaxStartups, host key failure, ...
+            self.ssh_exited(child.before)
+        if i == 2: # In this case SSH does not have the public key cached.
+            child.sendline('yes')
+            if child.expect([self.newkey_password, pexpect.EOF]) == 1:
+                self.ssh_exited(child.before)
+            child.sendline(self.password)
+            # Now we are at the command prompt.
+            if child.expect([self.prompt, pexpect.EOF]) == 1:
+                self.ssh_exited(child.before)
+        if i == 3:
+            # This may happen if a public key was setup to automatically login.
+            # But beware, the prompt at this point is very trivial and
+            # could be fooled by some output in the MOTD or login message.
+            pass
+        if i == 4:
+            child.sendline(self.password)
+            # Now we are at the command prompt.
+            i = child.expect([PASSWORD_AGAIN, self.prompt, pexpect.EOF])
+            if i == 0:
+                # password prompt again, probably because the password was not accepted
+                self.close()
+                raise SessionError('CRITICAL: permission denied; possible invalid password.')
+            if i == 2:
+                self.ssh_exited(child.before)
+
+        if self.shell:
+            self.set_prompt()
+
+        self.login_time = time.time() - start
+        if debug_enabled():
+            sys.stderr.write('%s: SSH login took %.3f seconds\n' % (self.hostname, self.login_time))
+        return child
+
+    def ssh_exited(self, output):
+        # ssh gave up before a shell came up; its last words say why
+        self.close()
+        lines = [line.strip() for line in (output or '').splitlines() if line.strip()]
+        if [line for line in lines if 'Permission denied' in line]:
+            # the host answered; a bad password must not open its breaker
+            raise SessionError('CRITICAL: permission denied; possible invalid password.')
+        if lines:
+            raise HostDown('CRITICAL: could not login with SSH: %s' % (lines[-1]))
+        raise HostDown('CRITICAL: could not login with SSH.')
+
+    def set_prompt(self, timeout=COMMAND_TIMEOUT):
+        """Give the shell a unique prompt and wait until it shows up."""
+        token = '%016x' % random.getrandbits(64)
+        self.child.sendline("unset PROMPT_COMMAND; PS1='%s''%s> '" % (PROMPT_MARKER, token))
+        marker = '%s%s> ' % (PROMPT_MARKER, token)
+        try:
+            self.child.expect_exact(marker, timeout=timeout)
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            # not a POSIX shell, or one that puts its own prompt back
+            self.close()
+            raise SessionError('UNKNOWN: could not set shell prompt', STATE_UNKNOWN)
+        self.marker = marker
+
+    def wait_prompt(self, timeout=COMMAND_TIMEOUT):
+        if self.marker is None:
+            self.child.expect(self.prompt, timeout=timeout)
+        else:
+            self.child.expect_exact(self.marker, timeout=timeout)
+
+    def sync(self, timeout=COMMAND_TIMEOUT):
+        """Wait until the shell echoes a fresh marker and prompts again."""
+        token = '%08x' % random.getrandbits(32)
+        self.child.sendline("echo '%s''%s'" % (SYNC_MARKER, token))
+        self.child.expect_exact(SYNC_MARKER + token, timeout=timeout)
+        self.wait_prompt(timeout)
+
+    def run(self, command, timeout=COMMAND_TIMEOUT):
+        """Issue command and return its output once the prompt comes back."""
+        self.child.sendline(command)
+        self.wait_prompt(timeout)
+        return self.child.before
+
+    def stream(self, command, feed, timeout=COMMAND_TIMEOUT):
+        """Issue command and hand its output to feed() piece by piece.
+
+        Nothing is collected, so a command with megabytes of output is read
+        in flat memory and linear time, unlike expect() which searches its
+        whole growing buffer after every read.
+        """
+        if self.marker is None:
+            feed(self.run(command, timeout=timeout))
+            return
+        self.child.sendline(command)
+        deadline = time.time() + timeout
+        # anything expect() read past the last prompt comes first
+        data = self.child.buffer
+        self.child.buffer = self.child.string_type()
+        while True:
+            i = data.find(self.marker)
+            if i >= 0:
+                feed(data[:i])
+                self.child.buffer = data[i + len(self.marker):]
+                return
+            # Hold back only what could be the start of a prompt split over
+            # two reads.
+            j = partial_marker(data, self.marker)
+            if j:
+                feed(data[:j])
+                data = data[j:]
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise pexpect.TIMEOUT('command timed out')
+            data += self.child.read_nonblocking(65536, remaining)
+
+    def run_many(self, commands, timeout=COMMAND_TIMEOUT, parallel=False):
+        """Send all of commands at once and return [(output, status), ...].
+
+        Each command is bracketed by echoed begin and end markers, the end one
+        carrying its exit status, so the output can be split up again after a
+        single round trip.  The commands must not read from stdin, or they
+        would eat the ones queued behind them.
+
+        On every transport the commands run one after the other, each once
+        the one before has finished, so a later command may clean up after
+        an earlier one.  parallel=True says they are independent of one
+        another: the exec and paramiko transports then run them side by
+        side; the shell always runs them in order.
+        """
+        tokens = ['%08x' % random.getrandbits(32) for command in commands]
+        lines = []
+        for command, token in zip(commands, tokens):
+            lines.append("echo '%s''%s'; %s; echo '%s''%s' $?\n"
+                         % (BEGIN_MARKER, token, command, END_MARKER, token))
+        self.child.send(''.join(lines))
+        results = []
+        for token in tokens:
+            self.child.expect_exact(BEGIN_MARKER + token, timeout=timeout)
+            self.child.expect(END_MARKER + token + ' (\\d+)', timeout=timeout)
+            output = self.child.before
+            if output.startswith('\r\n'):
+                output = output[2:]
+            results.append((output, int(self.child.match.group(1))))
+        self.wait_prompt(timeout)
+        return results
+
+    def close(self):
+        """Exit the remote shell and release the pseudo-terminal."""
+        child = self.child
+        self.child = None
+        if child is None:
+            return
+        if child.isalive():
+            try:
+                child.sendline('exit')
+            except OSError:
+                pass
+        child.close(force=True)
+
+    def logged_in(self):
+        return self.child is not None
+
+    def __enter__(self):
+        if self.child is None:
+            self.login()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def unix_request(path, request, timeout):
+    """Send one JSON line to the daemon on Unix socket path, return its reply.
+
+    Raises BrokerUnavailable when nothing answers on the socket, and
+    pexpect.TIMEOUT or pexpect.EOF when the daemon takes too long or hangs up.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            raise BrokerUnavailable(path)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise pexpect.EOF('%s closed the connection' % (path))
+            data += chunk
+    except socket.timeout:
+        raise pexpect.TIMEOUT('no answer on %s' % (path))
+    finally:
+        sock.close()
+    return json.loads(data.decode('utf-8'))
+
+
+class BrokerSession(object):
+    """Session whose commands are run by msp_broker.py on a shared login."""
+
+    def __init__(self, path, hostname, ipaddress, username, password):
+        self.path = path
+        self.hostname = hostname
+        self.ipaddress = ipaddress
+        self.username = username
+        self.password = password
+        self.login_time = None
+        self.active = False
+
+    def request(self, op, timeout=COMMAND_TIMEOUT, **kwargs):
+        kwargs.update(op=op, hostname=self.hostname, ipaddress=self.ipaddress,
+                      username=self.username, password=self.password, timeout=timeout)
+        # leave the broker time to log in before it runs the command
+        reply = unix_request(self.path, kwargs, timeout + MASTER_LOCK_TIMEOUT)
+        if 'error' in reply:
+            raise SessionError(reply['error'], reply['exit'])
+        if reply.get('exception') == 'TIMEOUT':
+            raise pexpect.TIMEOUT(reply['output'])
+        if reply.get('exception') == 'EOF':
+            raise pexpect.EOF(reply['output'])
+        return reply
+
+    def login(self):
+        reply = self.request('login', timeout=LOGIN_TIMEOUT)
+        self.login_time = reply['login_time']
+        self.active = True
+
+    def sync(self, timeout=COMMAND_TIMEOUT):
+        # the broker only hands out sessions that are at the prompt
+        pass
+
+    def run(self, command, timeout=COMMAND_TIMEOUT):
+        return self.request('run', timeout=timeout, command=command)['output']
+
+    def stream(self, command, feed, timeout=COMMAND_TIMEOUT):
+        feed(self.run(command, timeout=timeout))
+
+    def run_many(self, commands, timeout=COMMAND_TIMEOUT, parallel=False):
+        # the broker runs them in order on a shell
+        reply = self.request('run_many', timeout=timeout, commands=commands)
+        return [(output, status) for output, status in reply['results']]
+
+    def close(self):
+        self.active = False
+
+    def logged_in(self):
+        return self.active
+
+
+class ExecSession(object):
+    """Session that runs every command on its own SSH exec channel.
+
+    Commands go through an OpenSSH master for the host, started with a
+    normal password login the first time.  There is no pseudo-terminal, so
+    nothing is echoed, no prompt has to be matched, and a command is done as
+    soon as its channel closes.
+    """
+
+    def __init__(self, hostname, ipaddress, username, password, login_timeout=LOGIN_TIMEOUT):
+        self.hostname = hostname
+        self.ipaddress = ipaddress
+        self.username = username
+        self.password = password
+        self.login_timeout = login_timeout
+        control_dir = state_dir(setting('SSH_CONTROL_DIR', 'ssh'))
+        self.control_path = os.path.join(control_dir, '%s@%s' % (username, ipaddress))
+        self.login_time = None
+        self.active = False
+
+    def ssh_args(self, *args):
+        return ([SSH_PROGRAM, '-T', '-o', 'BatchMode=yes', '-o', 'ControlMaster=no',
+                 '-o', 'ControlPath=%s' % (self.control_path),
+                 '%s@%s' % (self.username, self.ipaddress)] + list(args))
+
+    def master_alive(self):
+        if not os.path.exists(self.control_path):
+            return False
+        devnull = open(os.devnull, 'w')
+        try:
+            return subprocess.call(self.ssh_args('-O', 'check'), stdout=devnull, stderr=devnull) == 0
+        finally:
+            devnull.close()
+
+    def login(self):
+        """Make sure a master is up for the host; raise SessionError on failure."""
+        start = time.time()
+        if not self.master_alive():
+            # Log in the usual way with the master options and leave: the
+            # master stays behind for ControlPersist seconds.
+            master = Session(self.hostname, self.ipaddress, self.username, self.password,
+                             login_timeout=self.login_timeout, shell=False)
+            master.control_path = self.control_path
+            master.login()
+            master.close()
+        self.login_time = time.time() - start
+        self.active = True
+        if debug_enabled():
+            sys.stderr.write('%s: SSH login took %.3f seconds\n' % (self.hostname, self.login_time))
+
+    def start(self, command):
+        devnull = open(os.devnull)
+        try:
+            return subprocess.Popen(self.ssh_args(command), stdin=devnull,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        finally:
+            devnull.close()
+
+    def finish(self, proc, deadline):
+        # Kill the channel if it runs past the deadline.
+        timer = threading.Timer(max(deadline - time.time(), 0), proc.kill)
+        timer.start()
+        try:
+            stdout, stderr = proc.communicate()
+        finally:
+            timer.cancel()
+        if proc.returncode < 0:
+            raise pexpect.TIMEOUT('command timed out')
+        if ENCODING is not None:
+            stdout = stdout.decode(ENCODING, 'replace')
+            stderr = stderr.decode(ENCODING, 'replace')
+        if proc.returncode == 255:
+            # ssh itself failed, most likely the master has gone away
+            self.active = False
+            raise pexpect.EOF(stderr.strip())
+        return stdout, stderr, proc.returncode
+
+    def execute(self, command, timeout=COMMAND_TIMEOUT):
+        """Run command and return (stdout, stderr, exit status)."""
+        return self.finish(self.start(command), time.time() + timeout)
+
+    def sync(self, timeout=COMMAND_TIMEOUT):
+        # every command gets a fresh channel, so there is nothing to resync
+        pass
+
+    def run(self, command, timeout=COMMAND_TIMEOUT):
+        stdout, stderr, status = self.execute(command, timeout)
+        return stdout + stderr
+
+    def stream(self, command, feed, timeout=COMMAND_TIMEOUT):
+        feed(self.run(command, timeout=timeout))
+
+    def run_many(self, commands, timeout=COMMAND_TIMEOUT, parallel=False):
+        # In order, see Session.run_many(); with parallel the channels of a
+        # group of EXEC_CHANNELS run side by side on the one master.
+        deadline = time.time() + timeout
+        group = EXEC_CHANNELS if parallel else 1
+        results = []
+        for i in range(0, len(commands), group):
+            procs = []
+            try:
+                for command in commands[i:i + group]:
+                    procs.append(self.start(command))
+                for proc in procs:
+                    stdout, stderr, status = self.finish(proc, deadline)
+                    results.append((stdout + stderr, status))
+            finally:
+                # after a failure none of the group is left running
+                for proc in procs:
+                    if proc.poll() is None:
+                        proc.kill()
+                        proc.communicate()
+        return results
+
+    def close(self):
+        # the master is left running for the next check
+        self.active = False
+
+    def logged_in(self):
+        return self.active
+
+
+class NativeSession(object):
+    """Session running exec channels over an in-process paramiko connection.
+
+    Connections are kept per (username, ipaddress, password) for the life of
+    the process, so further sessions to the same host, and the commands of
+    run_many(), are only new channels on the one connection.
+    """
+
+    connections = {}
+    # guards the two dicts; each key's own lock is held while it connects,
+    # so only sessions to the same host wait for one another
+    connections_lock = threading.Lock()
+    key_locks = {}
+
+    def __init__(self, hostname, ipaddress, username, password, login_timeout=LOGIN_TIMEOUT):
+        if paramiko is None:
+            raise SessionError('UNKNOWN: the paramiko transport needs the paramiko module', STATE_UNKNOWN)
+        self.hostname = hostname
+        self.ipaddress = ipaddress
+        self.username = username
+        self.password = password
+        self.login_timeout = login_timeout
+        self.transport = None
+        self.login_time = None
+
+    def login(self):
+        """Connect and authenticate, or reuse a live connection; raise SessionError on failure."""
+        start = time.time()
+        key = (self.username, self.ipaddress, self.password)
+        with self.connections_lock:
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self.connections_lock:
+                client = self.connections.get(key)
+            if client is None or not client.get_transport() or not client.get_transport().is_active():
+                client = CircuitBreaker(self.ipaddress).guard(self._limited_connect)
+                with self.connections_lock:
+                    self.connections[key] = client
+        self.transport = client.get_transport()
+        self.login_time = time.time() - start
+        if debug_enabled():
+            sys.stderr.write('%s: SSH login took %.3f seconds\n' % (self.hostname, self.login_time))
+
+    def _limited_connect(self):
+        slot = login_slot(self.ipaddress)
+        try:
+            return self.connect()
+        finally:
+            unlock_file(slot)
+
+    def connect(self):
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        # same as answering 'yes' to an unknown host key
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        try:
+            client.connect(self.ipaddress, username=self.username, password=self.password,
+                           timeout=self.login_timeout, banner_timeout=self.login_timeout,
+                           auth_timeout=self.login_timeout)
+        except paramiko.AuthenticationException:
+            client.close()
+            raise SessionError('CRITICAL: permission denied; possible invalid password.')
+        except (socket.error, paramiko.SSHException) as e:
+            client.close()
+            # paramiko collects the error of each address it tried in e.errors
+            errors = list(getattr(e, 'errors', {}).values()) + [e]
+            if [err for err in errors if getattr(err, 'errno', None) == errno.ECONNREFUSED]:
+                raise HostDown('CRITICAL: connection refused')
+            raise HostDown('CRITICAL: could not login with SSH.')
+        return client
+
+    def start(self, command):
+        try:
+            channel = self.transport.open_session()
+            channel.exec_command(command)
+        except (socket.error, paramiko.SSHException) as e:
+            self.transport = None
+            raise pexpect.EOF(str(e))
+        return channel
+
+    def finish(self, channel, deadline):
+        stdout = []
+        stderr = []
+        try:
+            while not (channel.eof_received and not channel.recv_ready()
+                       and not channel.recv_stderr_ready()):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise pexpect.TIMEOUT('command timed out')
+                select.select([channel], [], [], remaining)
+                while channel.recv_ready():
+                    stdout.append(channel.recv(65536))
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(65536))
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+        return (b''.join(stdout).decode('utf-8', 'replace'),
+                b''.join(stderr).decode('utf-8', 'replace'), status)
+
+    def execute(self, command, timeout=COMMAND_TIMEOUT):
+        """Run command and return (stdout, stderr, exit status)."""
+        return self.finish(self.start(command), time.time() + timeout)
+
+    def sync(self, timeout=COMMAND_TIMEOUT):
+        # every command gets a fresh channel, so there is nothing to resync
+        pass
+
+    def run(self, command, timeout=COMMAND_TIMEOUT):
+        stdout, stderr, status = self.execute(command, timeout)
+        return stdout + stderr
+
+    def stream(self, command, feed, timeout=COMMAND_TIMEOUT):
+        feed(self.run(command, timeout=timeout))
+
+    def run_many(self, commands, timeout=COMMAND_TIMEOUT, parallel=False):
+        # In order, see Session.run_many(); with parallel the channels of a
+        # group of EXEC_CHANNELS run side by side on the one connection.
+        deadline = time.time() + timeout
+        group = EXEC_CHANNELS if parallel else 1
+        results = []
+        for i in range(0, len(commands), group):
+            channels = []
+            try:
+                for command in commands[i:i + group]:
+                    channels.append(self.start(command))
+                for channel in channels:
+                    stdout, stderr, status = self.finish(channel, deadline)
+                    results.append((stdout + stderr, status))
+            finally:
+                # after a failure none of the group is left running
+                for channel in channels:
+                    channel.close()
+        return results
+
+    def close(self):
+        # the connection is kept for the next session to the host
+        self.transport = None
+
+    def logged_in(self):
+        return self.transport is not None and self.transport.is_active()
+
+
+# Session classes by MSP_SSH_TRANSPORT name
+TRANSPORTS = {
+    'shell': Session,
+    'exec': ExecSession,
+    'paramiko': NativeSession,
+}
+
+
+def transport_name():
+    if enabled('SSH_EXEC'):
+        return 'exec'
+    return setting('SSH_TRANSPORT', 'shell')
+
+
+def cache_ttl(command):
+    for prefix, ttl in CACHE_TTLS:
+        if command.startswith(prefix):
+            return ttl
+    return 0
+
+
+def cache_bypassed():
+    # Nagios retries a service in a soft non-OK state to confirm the problem;
+    # those retries have to see the server as it is now.
+    if enabled('CACHE_BYPASS'):
+        return True
+    try:
+        return int(os.environ.get('NAGIOS_SERVICEATTEMPT', '1')) > 1
+    except ValueError:
+        return False
+
+
+class ResultCache(object):
+    """Command output on disk, one JSON file per (host, command)."""
+
+    def __init__(self, path=None, size=None):
+        if path is None:
+            path = state_dir('cache')
+        if size is None:
+            size = int(setting('CACHE_SIZE', CACHE_SIZE))
+        self.path = path
+        self.size = size
+
+    def filename(self, host, command):
+        key = ('%s\n%s' % (host, command)).encode('utf-8')
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest())
+
+    def get(self, host, command, ttl, since=0):
+        """Return the output stored within the last ttl seconds and not
+        before since, or None."""
+        try:
+            with open(self.filename(host, command)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('host') != host or entry.get('command') != command:
+            return None
+        if time.time() - entry['time'] >= ttl or entry['time'] < since:
+            return None
+        return entry['output']
+
+    def lock(self, host, command, timeout):
+        # Kept apart from the entries so that eviction never removes a lock
+        # file someone is holding.
+        name = os.path.basename(self.filename(host, command))
+        return lock_file(os.path.join(state_dir('flight'), name), timeout)
+
+    def put(self, host, command, output):
+        # Write to a private temporary file and rename it into place, so a
+        # reader only ever sees a whole entry.
+        # A failed store only costs the next check a run of the command.
+        path = self.filename(host, command)
+        tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.current_thread().ident)
+        try:
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                json.dump({'host': host, 'command': command, 'time': time.time(), 'output': output}, f)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def evict(self):
+        # Remove the oldest entries until the cache fits in size bytes.
+        # Temporary files are another run's entry being written; they are
+        # only removed once older than any command may take, as left behind
+        # by a run that died.
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.path):
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            if name.endswith('.tmp'):
+                if now - st.st_mtime > COMMAND_TIMEOUT:
+                    try:
+                        os.unlink(os.path.join(self.path, name))
+                    except OSError:
+                        pass
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        while total > self.size and entries:
+            mtime, size, name = entries.pop(0)
+            try:
+                os.unlink(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+
+class CachedSession(object):
+    """Session that answers cacheable commands from the ResultCache.
+
+    The real session is only opened by opener() when a command has to go to
+    the server, so a check whose commands are all cached never logs in.  A
+    failed login is remembered and raised again for later commands.
+    """
+
+    def __init__(self, opener, hostname, ipaddress, username, cache=None):
+        self.opener = opener
+        self.hostname = hostname
+        self.username = username
+        self.host = '%s@%s %s' % (username, hostname, ipaddress)
+        if cache is None:
+            cache = ResultCache()
+        self.cache = cache
+        self.bypass = cache_bypassed()
+        self.session = None
+        self.error = None
+        self.closed = False
+
+    def connect(self):
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            raise SessionError('UNKNOWN: session closed', STATE_UNKNOWN)
+        if self.session is None:
+            try:
+                session = self.opener()
+            except SessionError as e:
+                self.error = e
+                raise
+            if self.closed:
+                # cancelled by another thread while the login was in progress
+                session.close()
+                raise SessionError('UNKNOWN: session closed', STATE_UNKNOWN)
+            self.session = session
+        return self.session
+
+    @property
+    def login_time(self):
+        if self.session is None:
+            return None
+        return self.session.login_time
+
+    def login(self):
+        if self.session is None or self.closed:
+            self.connect()
+        else:
+            self.session.login()
+
+    def cached(self, command):
+        ttl = cache_ttl(command)
+        if not ttl or self.bypass:
+            return None
+        return self.cache.get(self.host, command, ttl)
+
+    def store(self, command, output):
+        if cache_ttl(command):
+            self.cache.put(self.host, command, output)
+
+    def run(self, command, timeout=COMMAND_TIMEOUT):
+        def run_one(commands):
+            # run() gives no exit status; None stores the output regardless
+            return [(self.connect().run(commands[0], timeout=timeout), None)]
+        return self.fetch([command], run_one, timeout)[0][0]
+
+    def run_many(self, commands, timeout=COMMAND_TIMEOUT, parallel=False):
+        def run_all(commands):
+            return self.connect().run_many(commands, timeout=timeout, parallel=parallel)
+        return self.fetch(commands, run_all, timeout)
+
+    def fetch(self, commands, runner, timeout):
+        # Answer what the cache can and hand the rest to runner().  Cacheable
+        # commands are run single flight: while one check runs a command on
+        # a host, others that want it wait on its lock and then take the
+        # output it stored, so a burst of identical checks (a Nagios restart)
+        # runs the command once.
+        results = [None] * len(commands)
+        missing = []
+        for i, command in enumerate(commands):
+            output = self.cached(command)
+            if output is None:
+                missing.append(i)
+            else:
+                # only commands that succeeded are stored
+                results[i] = (output, 0)
+        if not missing:
+            return results
+        start = time.time()
+        flights = sorted(set(commands[i] for i in missing if cache_ttl(commands[i])))
+        locks = []
+        try:
+            for command in flights:
+                locks.append(self.cache.lock(self.host, command, timeout))
+            todo = []
+            for i in missing:
+                ttl = cache_ttl(commands[i])
+                # A retry that bypasses the cache still takes output that
+                # was stored after it asked.
+                output = None
+                if ttl:
+                    output = self.cache.get(self.host, commands[i], ttl, start if self.bypass else 0)
+                if output is not None:
+                    results[i] = (output, 0)
+                else:
+                    todo.append(i)
+            if todo:
+                fresh = runner([commands[i] for i in todo])
+                for i, (output, status) in zip(todo, fresh):
+                    if status in (0, None):
+                        self.store(commands[i], output)
+                    results[i] = (output, status)
+        finally:
+            for lock in locks:
+                unlock_file(lock)
+        return results
+
+    def execute(self, command, timeout=COMMAND_TIMEOUT):
+        return self.connect().execute(command, timeout=timeout)
+
+    def stream(self, command, feed, timeout=COMMAND_TIMEOUT):
+        # Streamed output is never stored: keeping all of it is what
+        # streaming avoids.
+        output = self.cached(command)
+        if output is None:
+            self.connect().stream(command, feed, timeout=timeout)
+        else:
+            feed(output)
+
+    def sync(self, timeout=COMMAND_TIMEOUT):
+        if self.session is not None:
+            self.session.sync(timeout)
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+    def cancel(self):
+        # Close for good, from another thread: a login in progress is
+        # dropped when it completes and later commands raise SessionError
+        # instead of logging in again.
+        self.closed = True
+        self.close()
+
+    def logged_in(self):
+        # not logged in yet still counts: the login happens on demand
+        return self.session is None or self.session.logged_in()
+
+
+def probe_command():
+    # One line per finding, the marker words split so the echo of the
+    # command line never looks like one.
+    return ("echo 'MSP_''SHELL' \"$0\"; "
+            "for c in %s; do p=$(PATH=$PATH:/sbin:/usr/sbin; command -v $c) && echo 'MSP_''COMMAND' $c $p; done; "
+            "for c in %s; do sudo -n -l $c >/dev/null 2>&1 && echo 'MSP_''SUDO' $c; done"
+            % (' '.join(PROBE_COMMANDS), ' '.join(PROBE_SUDO)))
+
+
+def capabilities(session):
+    """Return what the session's host offers, probing it when needed.
+
+    The answer is {'shell': ..., 'commands': {name: path}, 'sudo': [name, ...]}
+    and is kept for MSP_PROBE_TTL seconds (default a day) per user and host,
+    so a check can pick the command that works without trying the others.
+    Runs that bypass the cache probe again.
+    """
+    name = '%s@%s' % (session.username, session.hostname)
+    probe = load_state('probes', name)
+    ttl = int(setting('PROBE_TTL', PROBE_TTL))
+    if probe is None or time.time() - probe['time'] >= ttl or cache_bypassed():
+        output = session.run(probe_command())
+        probe = {'time': time.time(), 'shell': None, 'commands': {}, 'sudo': []}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == 'MSP_SHELL':
+                probe['shell'] = fields[1]
+            elif len(fields) == 3 and fields[0] == 'MSP_COMMAND':
+                probe['commands'][fields[1]] = fields[2]
+            elif len(fields) == 2 and fields[0] == 'MSP_SUDO':
+                probe['sudo'].append(fields[1])
+        save_state('probes', name, probe)
+    return probe
+
+
+def forget_capabilities(session):
+    """Drop the host's probe, for a check that found it out of date."""
+    try:
+        os.unlink(os.path.join(state_dir('probes'), '%s@%s' % (session.username, session.hostname)))
+    except OSError:
+        pass
+
+
+def daemon_socket(name, default):
+    # MSP_<name>, else default in the state directory; None if not there
+    path = setting(name) or os.path.join(setting('STATE_DIR', STATE_DIR), default)
+    if os.path.exists(path):
+        return path
+    return None
+
+
+def broker_socket():
+    return daemon_socket('BROKER_SOCKET', BROKER_SOCKET)
+
+
+def collector_socket():
+    return daemon_socket('TSCOLLECTOR_SOCKET', TSCOLLECTOR_SOCKET)
+
+
+def open_session(hostname, ipaddress, username, password, **kwargs):
+    """Log in through the session broker if one is running, else directly.
+
+    Sessions with a non-default prompt or login (such as the HP OA) always
+    log in directly to a shell.  Raises SessionError on failure.
+    """
+    path = broker_socket()
+    if path is not None and not kwargs:
+        session = BrokerSession(path, hostname, ipaddress, username, password)
+        try:
+            session.login()
+            return session
+        except BrokerUnavailable:
+            # stale socket left behind by a broker that is no longer running
+            pass
+    if kwargs:
+        transport = Session
+    else:
+        transport = TRANSPORTS.get(transport_name())
+        if transport is None:
+            raise SessionError('UNKNOWN: no such SSH transport %s' % (transport_name()), STATE_UNKNOWN)
+    session = transport(hostname, ipaddress, username, password, **kwargs)
+    session.login()
+    return session
+
+
+def open_cached(hostname, ipaddress, username, password):
+    """Like open_session(), but through the result cache when it is on.
+
+    The login then only happens when a command is not in the cache, and a
+    login failure is raised by the command that needed it.
+    """
+    opener = lambda: open_session(hostname, ipaddress, username, password)
+    if setting('CACHE', '1') == '0':
+        return opener()
+    return CachedSession(opener, hostname, ipaddress, username)
+
+
+def connect(hostname, ipaddress, username, password, **kwargs):
+    """Log in for a plugin; on failure report CRITICAL to Nagios and exit.
+
+    Plugins with the default login get a CachedSession, which logs in (or
+    reports the failure and exits) on the first command the cache cannot
+    answer.
+    """
+    def opener():
+        try:
+            return open_session(hostname, ipaddress, username, password, **kwargs)
+        except SessionError as e:
+            print('%s' % (e.resp))
+            sys.exit(e.exit)
+    if kwargs or setting('CACHE', '1') == '0':
+        return opener()
+    return CachedSession(opener, hostname, ipaddress, username)
+
+
+def report(resp, exit, out=None, session=None):
+    """Send the results to Nagios, close the session and exit."""
+    if session is not None:
+        session.close()
+    if out is None:
+        print('%s' % (resp))
+    else:
+        print('%s | %s' % (resp, out))
+    sys.exit(exit)
+
+
+def submit_passive(host, service, exit, resp, out=None, command_file=None):
+    """Hand a service check result to Nagios through its external command file."""
+    if command_file is None:
+        command_file = os.environ.get('NAGIOS_COMMAND_FILE', NAGIOS_COMMAND_FILE)
+    if out is not None:
+        resp = '%s | %s' % (resp, out)
+    # Nagios reads one command per line; multi-line output is sent escaped.
+    resp = resp.replace('\r', '').replace('\n', '\\n')
+    f = open(command_file, 'a')
+    try:
+        f.write('[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n'
+                % (int(time.time()), host, service, exit, resp))
+    finally:
+        f.close()
@@ -0,0 +1,300 @@
+#!/usr/local/bin/python2.7
+# -*- coding: UTF-8 -*-
+#
+# Collector for the TS communication of the Ericsson MSP DDC servers.  Keeps
+# a 'tail -F' of ddc_debug.log.0 open on every DDC server and counts the
+# requests sent to and responses received from the TS minute by minute, so
+# check_msp_ddctscomm.py can answer from memory without logging in.
+#
+# Written by Alan Sendgikoski <asendgi@gmail.com>
+#
+# Licence : GNU General Public Licence (GPL) http://www.gnu.org/
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+# 02110-1301, USA.
+#
+# $ python msp_tscollector.py [-f host file] [-U username] [-P password] [-s socket] [-k minutes] [-r restart]
+#     -f <host file>              File listing the DDC servers, 'hostname ipaddress' per line
+#     -U <username>               SSH username for the Remote servers
+#     -P <password>               SSH password for the Remote servers
+#     -s <socket>                 Unix socket to listen on
+#                                 (default /var/tmp/msp_plugins/tscollector.sock)
+#     -k <minutes>                Minutes of counts kept per server (default 60)
+#     -r <restart>                Seconds before a tail is restarted on a fresh login (default 3600)
+#
+# Run it as the Nagios user, next to Nagios.  check_msp_ddctscomm.py finds
+# the socket by itself and falls back to reading the log when the collector
+# is not running or has lost the server.  The host file of msp_fleet.py can
+# be used as is; anything after the IP address is ignored.
+#
+# Each request is one line of JSON, answered with one line of JSON:
+#     {"op": "counts", "hostname": ..., "minutes": ...}
+#     {"requests": ..., "responses": ..., "span": ..., "seconds": ..., "complete": ...}
+#     or  {"error": ...}
+# The counts are those of the last minutes minutes, the current one only
+# as far as it has gone, so span is that window in seconds.  seconds is how
+# much of it the tail was running; complete is false when the tail started,
+# or was restarted, within the window, and lines written meanwhile were not
+# counted.
+#
+
+from __future__ import absolute_import
+import getopt
+import json
+import msp_session
+import os
+import pexpect
+import signal
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+
+def exit_with_usage():
+
+    print(globals()['__doc__'])
+    os._exit(1)
+
+TAIL_COMMAND = 'tail -n 0 -F /var/log/miep/ddc_debug.log.0'
+
+# Seconds to wait before logging in again after losing a server
+RECONNECT_WAIT = 30
+
+class TSCounter(object):
+    """Requests and responses of one DDC server counted per minute."""
+
+    def __init__(self, keep):
+        self.keep = keep
+        self.lock = threading.Lock()
+        # minute (seconds since the epoch // 60) -> [requests, responses]
+        self.minutes = {}
+        self.partial = ''
+        # time the counting started, None while there is no tail
+        self.since = None
+        # (start, end) of the planned restarts since then, and the start of
+        # one in progress; lines written meanwhile are not counted
+        self.gaps = []
+        self.paused = None
+
+    def start(self):
+        with self.lock:
+            self.partial = ''
+            now = time.time()
+            if self.since is None:
+                self.since = now
+            elif self.paused is not None:
+                self.gaps.append((self.paused, now))
+                self.gaps = [gap for gap in self.gaps if gap[1] > now - self.keep * 60]
+            self.paused = None
+
+    def pause(self):
+        # The tail ended for a planned restart; the counts carry on.
+        with self.lock:
+            self.paused = time.time()
+
+    def stop(self):
+        with self.lock:
+            self.since = None
+            self.gaps = []
+            self.paused = None
+
+    def feed(self, data):
+        lines = (self.partial + data).split('\n')
+        self.partial = lines.pop()
+        minute = int(time.time() // 60)
+        requests = 0
+        responses = 0
+        for line in lines:
+            if 'Sending request to TS' in line:
+                requests += 1
+            elif 'Receiving response from TS' in line:
+                responses += 1
+        if not requests and not responses:
+            return
+        with self.lock:
+            counts = self.minutes.setdefault(minute, [0, 0])
+            counts[0] += requests
+            counts[1] += responses
+            for old in [m for m in self.minutes if m <= minute - self.keep]:
+                del self.minutes[old]
+
+    def counts(self, minutes):
+        # Counts for the last minutes minutes, the current one as far as it
+        # has gone, as (requests, responses, span, seconds, complete): the
+        # seconds the window spans, how many of them the tail was running,
+        # and whether that was all of them.
+        now = time.time()
+        with self.lock:
+            if self.since is None:
+                return None
+            minute = int(now // 60)
+            requests = 0
+            responses = 0
+            for m in range(minute - minutes + 1, minute + 1):
+                counts = self.minutes.get(m)
+                if counts is not None:
+                    requests += counts[0]
+                    responses += counts[1]
+            begin = (minute - minutes + 1) * 60
+            followed = now - max(begin, self.since)
+            gaps = list(self.gaps)
+            if self.paused is not None:
+                gaps.append((self.paused, now))
+            for start, end in gaps:
+                followed -= max(min(end, now) - max(start, begin), 0)
+            complete = self.since <= begin and followed >= now - begin
+        return requests, responses, int(now - begin), int(max(followed, 0)), complete
+
+
+class Collector(object):
+
+    def __init__(self, hosts, username, password, keep, restart):
+        self.hosts = hosts
+        self.username = username
+        self.password = password
+        self.restart = restart
+        self.counters = dict([(hostname, TSCounter(keep)) for hostname, ipaddress in hosts])
+
+    def follow(self, hostname, ipaddress):
+        # Keep a tail running on the server for as long as the collector
+        # runs, logging in again whenever the connection is lost and, to be
+        # sure a silently dead connection is noticed, every restart seconds.
+        counter = self.counters[hostname]
+        while True:
+            session = msp_session.Session(hostname, ipaddress, self.username, self.password)
+            try:
+                session.login()
+                counter.start()
+                session.stream(TAIL_COMMAND, counter.feed, timeout=self.restart)
+            except pexpect.TIMEOUT:
+                # only the planned restart; the counts carry on, short of
+                # what is written until the new tail is up
+                counter.pause()
+                session.close()
+                continue
+            except (msp_session.SessionError, pexpect.EOF, OSError):
+                pass
+            counter.stop()
+            session.close()
+            time.sleep(RECONNECT_WAIT)
+
+    def start(self):
+        for hostname, ipaddress in self.hosts:
+            follower = threading.Thread(target=self.follow, args=(hostname, ipaddress))
+            follower.daemon = True
+            follower.start()
+
+    def handle(self, request):
+        counter = self.counters.get(request.get('hostname'))
+        if counter is None:
+            return {'error': 'not collecting for %s' % (request.get('hostname'))}
+        counts = counter.counts(int(request.get('minutes', 5)))
+        if counts is None:
+            return {'error': 'no tail running on %s' % (request.get('hostname'))}
+        requests, responses, span, seconds, complete = counts
+        return {'requests': requests, 'responses': responses, 'span': span, 'seconds': seconds,
+                'complete': complete}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+        except ValueError:
+            reply = {'error': 'bad request'}
+        else:
+            reply = self.server.collector.handle(request)
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+class CollectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def read_hosts(path):
+    hosts = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            hosts.append((fields[0], fields[1]))
+    return hosts
+
+def main():
+
+    ######################################################################
+    ## Parse the options, arguments, get ready, etc.
+    ######################################################################
+
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'h?f:U:P:s:k:r:', ['help','h','?'])
+    except Exception as e:
+        print(str(e))
+        exit_with_usage()
+    options = dict(optlist)
+    if len(args) > 0:
+        exit_with_usage()
+
+    if [elem for elem in options if elem in ['-h','--h','-?','--?','--help']]:
+        print("Help:")
+        exit_with_usage()
+
+    if '-f' in options:
+        hosts = read_hosts(options['-f'])
+    else:
+        exit_with_usage()
+    if '-U' in options:
+        username = options['-U']
+    else:
+        exit_with_usage()
+    if '-P' in options:
+        password = options['-P']
+    else:
+        exit_with_usage()
+    if '-s' in options:
+        path = options['-s']
+    else:
+        path = msp_session.setting('TSCOLLECTOR_SOCKET') or os.path.join(msp_session.state_dir(), msp_session.TSCOLLECTOR_SOCKET)
+    keep = int(options.get('-k', 60))
+    restart = int(options.get('-r', 3600))
+
+    os.umask(0o077)
+    if os.path.exists(path):
+        os.unlink(path)
+    server = CollectorServer(path, RequestHandler)
+    server.collector = Collector(hosts, username, password, keep, restart)
+    server.collector.start()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+if __name__ == "__main__":
+    main()
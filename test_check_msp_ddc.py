@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_ddc.py that need no SSH server.
+#
+# $ python -m unittest test_check_msp_ddc
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import check_msp_ddc
+import msp_session
+from test_msp_session import CannedSession, StateDirTest
+
+# ddc_tool processinfo serv, as the poller's test DDC prints it
+SERV = '''\
+Server              Host          State
+ddc-1   hostname02msp1ddc01   OK
+ddc-2   hostname02msp1ddc02   OK
+ddc-3   hostname02msp1ddc03   OK
+ddc-4   hostname02msp1ddc04   OK
+ddc-5   hostname02msp1ddc05   OK
+ddc-6   hostname02msp1ddc06   OK
+ddc-7   hostname02msp1ddc07   OK
+ddc-8   hostname02msp1ddc08   NOT_RUNNING
+'''
+
+# with columns after the state and a summary line
+SERV_WIDE = '''\
+NAME      HOST                  STATE        UPTIME              PID    NOTE
+ddc-1     hostname02msp1ddc01   OK           12 days, 04:12:09   4211   -
+ddc-2     hostname02msp1ddc02   OK           12 days, 04:12:08   4213   restarted by pm
+ddc-3     hostname02msp1ddc03   FAILED       -                   -      core dumped
+Total: 3 servers, 2 OK, 1 FAILED
+'''
+
+STAT = 'Process stats: OK:  99.5%, no redundancy:   0.5%, lost:   0.0%, inconsistent:   0.0%\n'
+
+
+class ServersTest(unittest.TestCase):
+
+    def test_servers(self):
+        rows = check_msp_ddc.servers(SERV)
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[0], ('ddc-1', 'OK'))
+        self.assertEqual(rows[7], ('ddc-8', 'NOT_RUNNING'))
+
+    def test_columns_after_state(self):
+        self.assertEqual(check_msp_ddc.servers(SERV_WIDE),
+                         [('ddc-1', 'OK'), ('ddc-2', 'OK'), ('ddc-3', 'FAILED')])
+
+    def test_crlf(self):
+        self.assertEqual(check_msp_ddc.servers(SERV.replace('\n', '\r\n')), check_msp_ddc.servers(SERV))
+
+    def test_not_server_lines(self):
+        for text in ['', 'Total: 8 servers, 8 OK\n', 'Total 8 servers 8 OK\n',
+                     'bash: /opt/miep/tools/ddc_tool: No such file or directory\n',
+                     'Error: cannot connect to DDC, is it running?\n', 'NAME HOST STATE\n']:
+            self.assertEqual(check_msp_ddc.servers(text), [], repr(text))
+
+
+class CheckTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        os.environ['MSP_INVENTORY'] = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'msp_inventory.ini')
+
+    def check(self, serv, stat=STAT):
+        session = CannedSession({check_msp_ddc.DDC_TOOL + ' processinfo serv': (serv, 0),
+                                 check_msp_ddc.DDC_TOOL + ' processinfo stat': (stat, 0)})
+        return check_msp_ddc.check(session, 'hostname02msp1ddc01')
+
+    def test_check(self):
+        resp, exit, out = self.check(SERV)
+        self.assertEqual(exit, msp_session.STATE_WARNING)
+        self.assertTrue(resp.startswith('WARNING: 7 DDC Server States OK; not OK: ddc-8 (NOT_RUNNING) / '))
+        self.assertIn('WARNING: 99.5%', resp)
+
+    def test_unparsed_output_is_unknown(self):
+        ddc = check_msp_ddc.snapshot(CannedSession({}))
+        resp, exit, out = check_msp_ddc.check_serv('hostname02msp1ddc01', ddc)
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+        resp, exit, out = check_msp_ddc.check_stat(ddc)
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+
+    def test_stat_ok(self):
+        ddc = check_msp_ddc.snapshot(CannedSession({
+            check_msp_ddc.DDC_TOOL + ' processinfo stat':
+                ('Process stats: OK: 100.0%, no redundancy: 0.0%, lost: 0.0%, inconsistent: 0.0%\n', 0)}))
+        self.assertEqual(check_msp_ddc.check_stat(ddc)[1], msp_session.STATE_OK)
+
+
+if __name__ == '__main__':
+    unittest.main()
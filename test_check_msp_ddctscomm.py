@@ -0,0 +1,66 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_ddctscomm.py that need no SSH server.  The log is
+# read by running the check's commands with the local shell.
+#
+# $ python -m unittest test_check_msp_ddctscomm
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import check_msp_ddctscomm
+import msp_session
+from test_msp_session import LocalSession, StateDirTest
+
+REQUEST = '2026-10-18 10:00:01 DEBUG Sending request to TS 10.1.1.5\n'
+RESPONSE = '2026-10-18 10:00:01 DEBUG Receiving response from TS 10.1.1.5\n'
+OTHER = '2026-10-18 10:00:01 DEBUG Heartbeat from DDC peer\n'
+
+
+class CheckLogTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        self.logs = check_msp_ddctscomm.DDC_LOG, check_msp_ddctscomm.DDC_LOG_ROTATED
+        check_msp_ddctscomm.DDC_LOG = os.path.join(self.state, 'ddc_debug.log.0')
+        check_msp_ddctscomm.DDC_LOG_ROTATED = os.path.join(self.state, 'ddc_debug.log.1')
+        self.write(REQUEST + RESPONSE)
+
+    def tearDown(self):
+        check_msp_ddctscomm.DDC_LOG, check_msp_ddctscomm.DDC_LOG_ROTATED = self.logs
+        StateDirTest.tearDown(self)
+
+    def write(self, text):
+        with open(check_msp_ddctscomm.DDC_LOG, 'a') as f:
+            f.write(text)
+
+    def check(self):
+        return check_msp_ddctscomm.check_log(LocalSession(), 'hostname02msp1ddc01')
+
+    def test_counts_since_last_run(self):
+        resp, exit, out = self.check()
+        self.assertTrue(resp.startswith('OK: started reading'), resp)
+        self.write(REQUEST * 3 + OTHER + RESPONSE * 2)
+        resp, exit, out = self.check()
+        self.assertTrue(resp.startswith('OK: 3 requests sent to TS; 2 responses from TS'), resp)
+        resp, exit, out = self.check()
+        self.assertTrue(resp.startswith('WARNING: 0 requests sent to TS; 0 responses'), resp)
+
+    def test_rotation(self):
+        self.check()
+        self.write(REQUEST)
+        os.rename(check_msp_ddctscomm.DDC_LOG, check_msp_ddctscomm.DDC_LOG_ROTATED)
+        self.write(REQUEST + RESPONSE * 2)
+        resp, exit, out = self.check()
+        self.assertTrue(resp.startswith('OK: 2 requests sent to TS; 2 responses from TS'), resp)
+
+    def test_no_log(self):
+        os.unlink(check_msp_ddctscomm.DDC_LOG)
+        resp, exit, out = self.check()
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+
+
+if __name__ == '__main__':
+    unittest.main()
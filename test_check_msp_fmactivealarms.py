@@ -0,0 +1,109 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_fmactivealarms.py that need no SSH server.
+#
+# $ python -m unittest test_check_msp_fmactivealarms
+#
+
+from __future__ import absolute_import
+import unittest
+
+import check_msp_fmactivealarms
+import msp_session
+from test_msp_session import CannedSession, StateDirTest
+
+ALARMS = '''\
+Alarm Id           : 1021
+Severity           : critical
+Source             : ManagedElement=1,Node=3
+Event Time         : 2026-10-18 04:12:00
+Specific Problem   : Link down
+
+Alarm Id           : 1022
+Severity           : major
+Source             : ManagedElement=1,Node=5
+Event Time         : 2026-10-18 04:15:00
+Specific Problem   : Disk usage high
+
+MSP_FMSTATUS 0
+'''
+
+ONE_ALARM = ALARMS.split('\n\n')[1] + '\n\nMSP_FMSTATUS 0\n'
+
+NO_ALARMS = 'No active alarms\nMSP_FMSTATUS 0\n'
+
+
+class ParserTest(unittest.TestCase):
+
+    def parse(self, pieces):
+        parser = check_msp_fmactivealarms.AlarmParser()
+        for piece in pieces:
+            parser.feed(piece)
+        parser.close()
+        return parser
+
+    def test_alarms(self):
+        parser = self.parse([ALARMS])
+        self.assertEqual(parser.alarms, [
+            ('1021', 'critical', 'ManagedElement=1,Node=3', '2026-10-18 04:12:00'),
+            ('1022', 'major', 'ManagedElement=1,Node=5', '2026-10-18 04:15:00')])
+        self.assertEqual(parser.counts, {'critical': 1, 'major': 1, 'minor': 0})
+        self.assertEqual(parser.status, 0)
+        self.assertTrue(parser.recognised())
+
+    def test_split_anywhere(self):
+        whole = self.parse([ALARMS])
+        for i in range(1, len(ALARMS)):
+            parser = self.parse([ALARMS[:i], ALARMS[i:]])
+            self.assertEqual(parser.alarms, whole.alarms, 'split at %d' % (i))
+            self.assertEqual(parser.status, 0, 'split at %d' % (i))
+
+    def test_terminal_output(self):
+        # as read from a pseudo-terminal: CRLF line ends and colour codes
+        text = ALARMS.replace('\n', '\r\n').replace('critical', '\x1b[1;31mcritical\x1b[0m')
+        parser = self.parse([text[i:i + 7] for i in range(0, len(text), 7)])
+        self.assertEqual(parser.alarms, self.parse([ALARMS]).alarms)
+        self.assertEqual(parser.status, 0)
+
+    def test_no_alarms(self):
+        parser = self.parse([NO_ALARMS])
+        self.assertEqual(parser.alarms, [])
+        self.assertTrue(parser.recognised())
+
+    def test_error_output(self):
+        parser = self.parse(['sh: /appl/esa/bin/fmactivealarms: No such file or directory\n'
+                             'MSP_FMSTATUS 127\n'])
+        self.assertEqual(parser.status, 127)
+        self.assertFalse(parser.recognised())
+
+
+class CheckTest(StateDirTest):
+
+    def check(self, output):
+        session = CannedSession({check_msp_fmactivealarms.FMACTIVEALARMS: (output, 0)})
+        return check_msp_fmactivealarms.check(session, 'hostname02msp1da01')
+
+    def test_changes_against_snapshot(self):
+        resp, exit, out = self.check(ALARMS)
+        self.assertEqual(exit, msp_session.STATE_CRITICAL)
+        self.assertIn('2 new; 0 cleared', resp)
+        resp, exit, out = self.check(ONE_ALARM)
+        self.assertEqual(exit, msp_session.STATE_WARNING)
+        self.assertIn('0 new; 1 cleared', resp)
+        self.assertIn('CLEARED critical alarm 1021', out)
+        resp, exit, out = self.check(NO_ALARMS)
+        self.assertEqual(exit, msp_session.STATE_OK)
+        self.assertIn('0 new; 1 cleared', resp)
+
+    def test_failed_run_keeps_snapshot(self):
+        self.check(ALARMS)
+        for output in ['', 'MSP_FMSTATUS 0\n', 'Connection to ESA lost\nMSP_FMSTATUS 1\n',
+                       'Alarm Id : 1021\n']:
+            resp, exit, out = self.check(output)
+            self.assertEqual(exit, msp_session.STATE_UNKNOWN, repr(output))
+        resp, exit, out = self.check(ALARMS)
+        self.assertIn('0 new; 0 cleared', resp)
+
+
+if __name__ == '__main__':
+    unittest.main()
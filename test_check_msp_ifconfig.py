@@ -0,0 +1,102 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_ifconfig.py that need no SSH server.
+#
+# $ python -m unittest test_check_msp_ifconfig
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import check_msp_ifconfig
+import msp_session
+from test_msp_session import CannedSession, StateDirTest
+
+INTERFACE = '''\
+eth%d     Link encap:Ethernet  HWaddr 00:50:56:8A:1C:0%d
+          inet addr:10.1.1.%d  Bcast:10.1.1.255  Mask:255.255.255.0
+          UP BROADCAST RUNNING MULTICAST  MTU:1500  Metric:1
+
+'''
+
+DOWN = '''\
+eth9      Link encap:Ethernet  HWaddr 00:50:56:8A:1C:09
+          BROADCAST MULTICAST  MTU:1500  Metric:1
+
+'''
+
+IFCONFIG = ''.join([INTERFACE % (n, n, n) for n in range(8)]) + DOWN
+
+INVENTORY = '''\
+[hosts]
+hostname02msp1da = da
+hostname02mspadm = adm
+
+[role da]
+interfaces = 8
+
+[role adm]
+interfaces = 8
+ifconfig = /usr/local/sbin/ifconfig -a
+'''
+
+
+class CheckTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        path = os.path.join(self.state, 'inventory.ini')
+        with open(path, 'w') as f:
+            f.write(INVENTORY)
+        os.environ['MSP_INVENTORY'] = path
+
+    def check(self, hostname, probe, outputs):
+        outputs = dict(outputs)
+        outputs["echo 'MSP_''SHELL'"] = (probe, 0)
+        session = CannedSession(outputs)
+        session.username = 'user'
+        session.hostname = hostname
+        result = check_msp_ifconfig.check(session, hostname)
+        return result, [command for command in session.commands if not command.startswith('echo')]
+
+    def test_sudo(self):
+        (resp, exit, out), commands = self.check(
+            'hostname02msp1da01', 'MSP_COMMAND ifconfig /sbin/ifconfig\nMSP_SUDO ifconfig\n',
+            {'sudo -n ifconfig -a': (IFCONFIG, 0)})
+        self.assertEqual((resp, exit), ('OK: 8 interfaces UP', msp_session.STATE_OK))
+        self.assertEqual(commands, ['sudo -n ifconfig -a'])
+
+    def test_path(self):
+        (resp, exit, out), commands = self.check(
+            'hostname02msp1da01', 'MSP_COMMAND ifconfig /usr/sbin/ifconfig\n',
+            {'/usr/sbin/ifconfig -a': (IFCONFIG.replace(' UP BROADCAST', ' BROADCAST', 1), 0)})
+        self.assertEqual((resp, exit), ('WARNING: 7 interfaces UP', msp_session.STATE_WARNING))
+        self.assertEqual(commands, ['/usr/sbin/ifconfig -a'])
+
+    def test_role_command(self):
+        (resp, exit, out), commands = self.check(
+            'hostname02mspadm01', '', {'/usr/local/sbin/ifconfig -a': (IFCONFIG, 0)})
+        self.assertEqual(exit, msp_session.STATE_OK)
+        self.assertEqual(commands, ['/usr/local/sbin/ifconfig -a'])
+
+    def test_no_ifconfig(self):
+        (resp, exit, out), commands = self.check('hostname02msp1da01', 'MSP_SHELL -bash\n', {})
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+        self.assertEqual(commands, [])
+
+    def test_no_count(self):
+        (resp, exit, out), commands = self.check('otherhost', '', {})
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+
+    def test_sudo_taken_away(self):
+        (resp, exit, out), commands = self.check(
+            'hostname02msp1da01', 'MSP_COMMAND ifconfig /sbin/ifconfig\nMSP_SUDO ifconfig\n',
+            {'sudo -n ifconfig -a': ('sudo: a password is required\n', 1)})
+        self.assertEqual(exit, msp_session.STATE_CRITICAL)
+        # probed again by the next run
+        self.assertIsNone(msp_session.load_state('probes', 'user@hostname02msp1da01'))
+
+
+if __name__ == '__main__':
+    unittest.main()
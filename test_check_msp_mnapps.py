@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_mnapps.py that need no SSH server.
+#
+# $ python -m unittest test_check_msp_mnapps
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import check_msp_mnapps
+import msp_session
+from test_msp_session import CannedSession, StateDirTest
+
+
+def unit(name, active):
+    return ('● mnapps-%s.service - MNapps %s\n'
+            '   Loaded: loaded (/etc/systemd/system/mnapps-%s.service; enabled)\n'
+            '  Drop-In: /etc/systemd/system/mnapps-%s.service.d\n'
+            '           └─override.conf\n'
+            '   Active: %s since Sat 2026-10-17 10:00:00 UTC; 1 day ago\n'
+            ' Main PID: 1234 (java)\n'
+            '\n'
+            'Oct 17 10:00:00 host systemd[1]: Started MNapps %s.service - active.\n'
+            '-- Reboot --\n'
+            '\n' % (name, name, name, name, active, name))
+
+NAMES = ['alpha', 'beta', 'gamma', 'delta', 'eps', 'zeta', 'eta', 'theta', 'iota']
+
+STATUS = ''.join([unit(name, 'active (running)') for name in NAMES])
+
+
+class ServicesTest(unittest.TestCase):
+
+    def test_services(self):
+        records = check_msp_mnapps.services(STATUS)
+        self.assertEqual(records, [('mnapps-%s' % (name), 'active', 'running') for name in NAMES])
+
+    def test_failed(self):
+        records = check_msp_mnapps.services(unit('iota', 'failed (Result: exit-code)'))
+        self.assertEqual(records, [('mnapps-iota', 'failed', 'Result: exit-code')])
+
+    def test_unnamed(self):
+        records = check_msp_mnapps.services('   Active: active (running) since Sat\n' + unit('beta', 'inactive (dead)'))
+        self.assertEqual(records, [(None, 'active', 'running'), ('mnapps-beta', 'inactive', 'dead')])
+        # no Nagios service to submit the unnamed one to
+        self.assertEqual([service for service, resp, exit in check_msp_mnapps.check_services(records)],
+                         ['mnapps-beta'])
+
+
+class CheckTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        os.environ['MSP_INVENTORY'] = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'msp_inventory.ini')
+
+    def check(self, output):
+        session = CannedSession({'/opt/miep/tools/mnapps status': (output, 0)})
+        return check_msp_mnapps.check(session, 'hostname02mspmn01')
+
+    def test_all_active(self):
+        resp, exit, out = self.check(STATUS)
+        self.assertEqual((resp, exit), ('OK: All 9 MNapps services are in Active state', msp_session.STATE_OK))
+
+    def test_not_active(self):
+        resp, exit, out = self.check(STATUS.replace(unit('iota', 'active (running)'),
+                                                    unit('iota', 'failed (Result: exit-code)')))
+        self.assertEqual(exit, msp_session.STATE_WARNING)
+        self.assertIn('not active: mnapps-iota', resp)
+
+    def test_unnamed_is_unknown(self):
+        resp, exit, out = self.check(STATUS.replace('● mnapps-iota.service - MNapps iota\n', ''))
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+        self.assertIn('1 without a service name', resp)
+        self.assertIn('UNKNOWN: service without a name is active (running)', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
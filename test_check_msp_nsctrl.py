@@ -0,0 +1,79 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_nsctrl.py that need no SSH server.
+#
+# $ python -m unittest test_check_msp_nsctrl
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import check_msp_nsctrl
+import msp_session
+from test_msp_session import CannedSession, StateDirTest
+
+STATUS = '''\
+Instance   Status                   Process
+da1        Running                  Diameter Agent
+tr1        Stopped                  Traffic Regulator
+'''
+
+# with columns after the process name
+STATUS_WIDE = '''\
+Instance   Status                   Process                  Pid     Since\r
+da1        Running                  Diameter Agent           4211    2026-10-17 22:01\r
+tr1        Running                  Traffic Regulator        4230    2026-10-17 22:01\r
+om1        Stopped                  OAM Agent                -       -\r
+'''
+
+
+class ProcessesTest(unittest.TestCase):
+
+    def test_processes(self):
+        self.assertEqual(check_msp_nsctrl.processes(STATUS),
+                         [('Diameter Agent', 'Running'), ('Traffic Regulator', 'Stopped')])
+
+    def test_columns_after_name(self):
+        self.assertEqual(check_msp_nsctrl.processes(STATUS_WIDE),
+                         [('Diameter Agent', 'Running'), ('Traffic Regulator', 'Running'),
+                          ('OAM Agent', 'Stopped')])
+
+    def test_nothing_parsed(self):
+        for text in ['', 'sh: nsctrl: command not found\n', 'Instance   Status   Process\n']:
+            self.assertEqual(check_msp_nsctrl.processes(text), [], repr(text))
+
+
+class CheckTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        os.environ['MSP_INVENTORY'] = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                   'msp_inventory.ini')
+
+    def check(self, hostname, output):
+        return check_msp_nsctrl.check(CannedSession({'nsctrl status': (output, 0)}), hostname)
+
+    def test_role_processes(self):
+        # role da-tr expects Diameter Agent and Traffic Regulator
+        resp, exit, out = self.check('hostname03msp1da01', STATUS_WIDE)
+        self.assertEqual((resp, exit), ('OK: 2 processes Running', msp_session.STATE_OK))
+        resp, exit, out = self.check('hostname03msp1da01', STATUS)
+        self.assertEqual(exit, msp_session.STATE_WARNING)
+        self.assertIn('Traffic Regulator (Stopped)', resp)
+
+    def test_no_role(self):
+        resp, exit, out = self.check('otherhost', STATUS_WIDE)
+        self.assertEqual(exit, msp_session.STATE_WARNING)
+        self.assertIn('2 processes Running; 1 processes Stopped: OAM Agent (Stopped)', resp)
+
+    def test_nothing_parsed_is_unknown(self):
+        for hostname in ('hostname03msp1da01', 'otherhost'):
+            resp, exit, out = self.check(hostname, 'sh: nsctrl: command not found\n')
+            self.assertEqual(exit, msp_session.STATE_UNKNOWN, hostname)
+        self.assertEqual([exit for process, resp, exit in check_msp_nsctrl.check_processes('hostname03msp1da01', [])],
+                         [msp_session.STATE_UNKNOWN, msp_session.STATE_UNKNOWN])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for check_msp_pallogviewer.py that need no SSH server.  The log is
+# read by running the check's commands with the local shell, pallogviewer
+# being a stand-in that prints one record per alarm entry.
+#
+# $ python -m unittest test_check_msp_pallogviewer
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import check_msp_pallogviewer
+import msp_session
+from test_msp_session import LocalSession, StateDirTest
+
+ALARM = '<entry type="alarm" date="2026-10-18 10:00:01"><text>Link down</text></entry>\n'
+CLEAR = '<entry type="alarmClear" date="2026-10-18 10:00:02"><text>Link up</text></entry>\n'
+SUBTYPE = '<entry type="event" subtype="alarm" date="2026-10-18 10:00:03"><text>x</text></entry>\n'
+EVENT = '<entry type="event" date="2026-10-18 10:00:04"><text>Started</text></entry>\n'
+
+PALLOGVIEWER = '''#!/bin/sh
+for log; do :; done
+grep -o 'type="alarm"' "$log" | while read l; do printf 'Record\\nType    = alarm\\n\\n'; done
+'''
+
+
+class CountAlarmsTest(StateDirTest):
+
+    def test_count(self):
+        path = os.path.join(self.state, 'log')
+        with open(path, 'w') as f:
+            f.write(ALARM + CLEAR + SUBTYPE + EVENT + ALARM.replace('type=', 'type = ')
+                    + ALARM.upper())
+        output = LocalSession().run('%s < %s' % (check_msp_pallogviewer.COUNT_ALARMS, path))
+        self.assertEqual(output, 'MSP_COUNTS 3\n')
+
+
+class CheckTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        self.log = os.path.join(self.state, 'troubleshooter_log.xml')
+        self.names = ('TROUBLESHOOTER_LOG', 'ALARMS_TODAY', 'CURSOR')
+        self.constants = [getattr(check_msp_pallogviewer, name) for name in self.names]
+        for name, value in zip(self.names, self.constants):
+            setattr(check_msp_pallogviewer, name, value.replace(self.constants[0], self.log))
+        self.script('pallogviewer', PALLOGVIEWER)
+        os.environ['PATH'] = self.state + os.pathsep + os.environ['PATH']
+        self.write(EVENT + ALARM)
+
+    def tearDown(self):
+        for name, value in zip(self.names, self.constants):
+            setattr(check_msp_pallogviewer, name, value)
+        StateDirTest.tearDown(self)
+
+    def write(self, text):
+        with open(self.log, 'a') as f:
+            f.write(text)
+
+    def check(self):
+        return check_msp_pallogviewer.check(LocalSession(), 'hostname02mspadm01')
+
+    def test_running_count(self):
+        resp, exit, out = self.check()
+        self.assertEqual((resp, exit), ('WARNING: 1 logs of Type = alarm', msp_session.STATE_WARNING))
+        self.assertIsNotNone(out)
+        self.write(ALARM + CLEAR + SUBTYPE + ALARM)
+        resp, exit, out = self.check()
+        self.assertEqual(resp, 'WARNING: 3 logs of Type = alarm')
+        # counted from the cursor, not scanned again
+        self.assertIsNone(out)
+
+    def test_rotated(self):
+        self.check()
+        os.rename(self.log, self.log + '.1')
+        self.write(EVENT)
+        resp, exit, out = self.check()
+        self.assertEqual((resp, exit), ('OK: 0 logs of Type = alarm', msp_session.STATE_OK))
+
+    def test_no_log(self):
+        os.unlink(self.log)
+        resp, exit, out = self.check()
+        self.assertEqual(exit, msp_session.STATE_UNKNOWN)
+
+
+if __name__ == '__main__':
+    unittest.main()
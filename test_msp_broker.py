@@ -0,0 +1,74 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for msp_broker.py that need no SSH server.
+#
+# $ python -m unittest test_msp_broker
+#
+
+from __future__ import absolute_import
+import unittest
+
+import msp_broker
+import msp_session
+
+
+class FakeSession(object):
+    """Stands in for msp_session.Session; remembers the password it used."""
+
+    def __init__(self, hostname, ipaddress, username, password):
+        self.password = password
+        self.login_time = 0.1
+        self.closed = False
+
+    def login(self):
+        pass
+
+    def run(self, command, timeout=None):
+        return 'output of %s' % (command)
+
+    def close(self):
+        self.closed = True
+
+
+class HostPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = msp_session.Session
+        msp_session.Session = FakeSession
+        self.broker = msp_broker.Broker(2, 60, 900)
+
+    def tearDown(self):
+        msp_session.Session = self.session
+
+    def request(self, password):
+        return {'hostname': 'host', 'ipaddress': '10.0.0.1', 'username': 'user',
+                'password': password, 'op': 'run', 'command': 'uptime'}
+
+    def test_idle_session_reused(self):
+        pool = self.broker.pool(self.request('old'))
+        pool.login()
+        session = pool.idle[0][0]
+        self.assertEqual(self.broker.handle(self.request('old')), {'output': 'output of uptime'})
+        self.assertEqual([s for s, last_used in pool.idle], [session])
+
+    def test_password_change_closes_idle_sessions(self):
+        pool = self.broker.pool(self.request('old'))
+        pool.login()
+        old = pool.idle[0][0]
+        self.broker.pool(self.request('new'))
+        self.assertTrue(old.closed)
+        self.assertEqual(pool.idle, [])
+
+    def test_password_change_closes_busy_session_on_checkin(self):
+        pool = self.broker.pool(self.request('old'))
+        busy = pool.checkout()
+        self.broker.pool(self.request('new'))
+        pool.checkin(busy)
+        self.assertTrue(busy.closed)
+        self.assertEqual(pool.idle, [])
+        self.broker.handle(self.request('new'))
+        self.assertEqual([s.password for s, last_used in pool.idle], ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
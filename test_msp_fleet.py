@@ -0,0 +1,64 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for msp_fleet.py that need no SSH server.  Needs Python 3.
+#
+# $ python3 -m unittest test_msp_fleet
+#
+
+import asyncio
+import unittest
+
+import pexpect
+
+import check_msp_batch
+import msp_fleet
+import msp_session
+
+
+class FakeSession(object):
+
+    def __init__(self, error):
+        self.error = error
+
+    def logged_in(self):
+        return False
+
+    def login(self):
+        raise self.error
+
+    def close(self):
+        pass
+
+
+class SweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.open_cached = msp_session.open_cached
+
+    def tearDown(self):
+        msp_session.open_cached = self.open_cached
+
+    def test_one_host_failing_does_not_stop_the_sweep(self):
+        def open_cached(hostname, ipaddress, username, password):
+            if hostname == 'broken':
+                raise ValueError('bad answer')
+            if hostname == 'eof':
+                return FakeSession(pexpect.EOF('ssh exited'))
+            return FakeSession(msp_session.SessionError('CRITICAL: permission denied'))
+        msp_session.open_cached = open_cached
+        checks = check_msp_batch.parse_checks('disk,nsctrl')
+        hosts = [('broken', '10.0.0.1', checks), ('eof', '10.0.0.2', checks),
+                 ('denied', '10.0.0.3', checks)]
+        results = dict(asyncio.run(msp_fleet.sweep(hosts, 'user', 'password', 2, 10)))
+        self.assertEqual(sorted(results), ['broken', 'denied', 'eof'])
+        for hostname in ('broken', 'eof'):
+            self.assertEqual([(service, exit) for service, resp, exit, out in results[hostname]],
+                             [('disk', msp_session.STATE_UNKNOWN), ('nsctrl', msp_session.STATE_UNKNOWN)])
+        self.assertIn('ValueError', results['broken'][0][1])
+        self.assertIn('EOF', results['eof'][0][1])
+        self.assertEqual([exit for service, resp, exit, out in results['denied']],
+                         [msp_session.STATE_CRITICAL, msp_session.STATE_CRITICAL])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for msp_inventory.py.
+#
+# $ python -m unittest test_msp_inventory
+#
+
+from __future__ import absolute_import
+import os
+import unittest
+
+import msp_inventory
+from test_msp_session import StateDirTest
+
+INVENTORY = '''\
+[DEFAULT]
+mnapps = 9
+
+[hosts]
+hostname02msp1da = da
+hostname03msp1da01 = da-tr
+*msp[12]ddc* = ddc
+*ddc* = other
+
+[role da]
+interfaces = 8
+processes = Diameter Agent
+
+[role da-tr]
+interfaces = 8
+processes = Diameter Agent, Traffic Regulator
+mnapps = 0
+
+[role ddc]
+interfaces = 7
+'''
+
+
+class InventoryTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        self.path = os.path.join(self.state, 'inventory.ini')
+        self.write(INVENTORY)
+        os.environ['MSP_INVENTORY'] = self.path
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def test_roles(self):
+        self.assertEqual(msp_inventory.role('hostname02msp1da01'), 'da')
+        self.assertEqual(msp_inventory.role('hostname02msp1da'), 'da')
+        self.assertEqual(msp_inventory.role('hostname03msp1da01'), 'da-tr')
+        self.assertEqual(msp_inventory.role('HOSTNAME02MSP1DA01.example.net'), 'da')
+        # patterns in the order listed
+        self.assertEqual(msp_inventory.role('hostname04msp2ddc01'), 'ddc')
+        self.assertEqual(msp_inventory.role('hostname04msp3ddc01'), 'other')
+        self.assertIsNone(msp_inventory.role('hostname03msp1da02'))
+
+    def test_values(self):
+        self.assertEqual(msp_inventory.get('hostname02msp1da01', 'interfaces'), '8')
+        self.assertEqual(msp_inventory.get_list('hostname03msp1da01', 'processes'),
+                         ['Diameter Agent', 'Traffic Regulator'])
+        self.assertEqual(msp_inventory.get_list('hostname04msp1ddc01', 'processes'), [])
+        # [DEFAULT] for every role and for hosts without one
+        self.assertEqual(msp_inventory.get('hostname02msp1da01', 'mnapps'), '9')
+        self.assertEqual(msp_inventory.get('hostname03msp1da01', 'mnapps'), '0')
+        self.assertEqual(msp_inventory.get('unknownhost', 'mnapps'), '9')
+        self.assertEqual(msp_inventory.get('unknownhost', 'interfaces', 'none'), 'none')
+        # a role without a section of its own has only the [DEFAULT] values
+        self.assertIsNone(msp_inventory.get('hostname04msp3ddc01', 'interfaces'))
+        self.assertEqual(msp_inventory.get('hostname04msp3ddc01', 'mnapps'), '9')
+
+    def test_reload_on_change(self):
+        self.assertEqual(msp_inventory.get('hostname02msp1da01', 'interfaces'), '8')
+        self.write(INVENTORY.replace('interfaces = 8\nprocesses = Diameter Agent\n',
+                                     'interfaces = 10\n'))
+        os.utime(self.path, (1, 1))
+        self.assertEqual(msp_inventory.get('hostname02msp1da01', 'interfaces'), '10')
+
+    def test_missing_file(self):
+        os.environ['MSP_INVENTORY'] = os.path.join(self.state, 'missing.ini')
+        self.assertIsNone(msp_inventory.role('hostname02msp1da01'))
+        self.assertIsNone(msp_inventory.get('hostname02msp1da01', 'interfaces'))
+
+    def test_shipped_inventory(self):
+        os.environ['MSP_INVENTORY'] = msp_inventory.INVENTORY_FILE
+        self.assertEqual(msp_inventory.get('hostname02msp1ts01', 'interfaces'), '14')
+        self.assertEqual(msp_inventory.get('hostname05msp2da01', 'processes'),
+                         'Diameter Agent, Traffic Regulator')
+        self.assertEqual(msp_inventory.get('hostname02msp1ddc01', 'ddc_servers'), '8')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,466 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for msp_session.py that need no SSH server.
+#
+# $ python -m unittest test_msp_session
+#
+
+from __future__ import absolute_import
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import pexpect
+
+import msp_session
+
+
+class FakeChild(object):
+    """Stands in for a pexpect child, handing out reads one by one."""
+
+    string_type = str
+
+    def __init__(self, reads):
+        self.reads = list(reads)
+        self.buffer = ''
+
+    def sendline(self, line):
+        pass
+
+    def read_nonblocking(self, size, timeout):
+        if not self.reads:
+            raise pexpect.TIMEOUT('no more output')
+        return self.reads.pop(0)
+
+
+class StateDirTest(unittest.TestCase):
+    """Runs each test with MSP_STATE_DIR in a fresh temporary directory."""
+
+    def setUp(self):
+        self.state = tempfile.mkdtemp()
+        self.saved = dict(os.environ)
+        os.environ['MSP_STATE_DIR'] = self.state
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved)
+        shutil.rmtree(self.state)
+
+    def script(self, name, text):
+        path = os.path.join(self.state, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        os.chmod(path, stat.S_IRWXU)
+        return path
+
+
+class CannedSession(object):
+    """Stands in for a logged in session, answering commands from outputs.
+
+    outputs maps the start of a command to its (output, status); every
+    command run is kept in commands.
+    """
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+        self.commands = []
+
+    def answer(self, command):
+        self.commands.append(command)
+        for prefix, result in self.outputs.items():
+            if command.startswith(prefix):
+                return result
+        return ('sh: %s: command not found\n' % (command.split()[0]), 127)
+
+    def run(self, command, timeout=None):
+        return self.answer(command)[0]
+
+    def run_many(self, commands, timeout=None, parallel=False):
+        return [self.answer(command) for command in commands]
+
+    def stream(self, command, feed, timeout=None):
+        feed(self.run(command))
+
+
+class LocalSession(object):
+    """Stands in for a logged in session, running commands with the local sh."""
+
+    def run(self, command, timeout=None):
+        proc = subprocess.Popen(['/bin/sh', '-c', command], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True)
+        return proc.communicate()[0]
+
+    def stream(self, command, feed, timeout=None):
+        feed(self.run(command))
+
+
+class StreamTest(unittest.TestCase):
+
+    marker = msp_session.PROMPT_MARKER + '0123456789abcdef> '
+    body = 'line one\nline two MSP_PRO\nM\nlast line\n'
+
+    def stream(self, reads):
+        session = msp_session.Session('fakehost', '127.0.0.1', 'user', 'password')
+        session.marker = self.marker
+        session.child = FakeChild(reads)
+        pieces = []
+        session.stream('command', pieces.append, timeout=5)
+        # what was read past the prompt, and what was left unread
+        return ''.join(pieces), session.child.buffer + ''.join(session.child.reads)
+
+    def test_prompt_split_at_every_offset(self):
+        data = self.body + self.marker + 'after'
+        for i in range(1, len(data)):
+            output, rest = self.stream([data[:i], data[i:]])
+            self.assertEqual(output, self.body, 'split at %d' % (i))
+            self.assertEqual(rest, 'after', 'split at %d' % (i))
+
+    def test_prompt_one_character_per_read(self):
+        data = self.body + self.marker
+        output, rest = self.stream(list(data))
+        self.assertEqual(output, self.body)
+
+    def test_partial_marker(self):
+        self.assertEqual(msp_session.partial_marker('abc', self.marker), 3)
+        self.assertEqual(msp_session.partial_marker('abcMSP_PROM', self.marker), 3)
+        self.assertEqual(msp_session.partial_marker('abcMSP_PROMPT_0123M', self.marker), 18)
+        self.assertEqual(msp_session.partial_marker('', self.marker), 0)
+
+
+class LoginSlotTest(StateDirTest):
+
+    def test_limit(self):
+        os.environ['MSP_LOGIN_LIMIT'] = '2'
+        os.environ['MSP_LOGIN_WAIT'] = '0.3'
+        slots = [msp_session.login_slot('10.0.0.1'), msp_session.login_slot('10.0.0.1')]
+        # a third has to wait, then gives up
+        with self.assertRaises(msp_session.SessionError) as e:
+            msp_session.login_slot('10.0.0.1')
+        self.assertEqual(e.exception.exit, msp_session.STATE_UNKNOWN)
+        # other hosts have their own slots
+        msp_session.unlock_file(msp_session.login_slot('10.0.0.2'))
+        # and one freed is taken by the next in the queue
+        msp_session.unlock_file(slots.pop())
+        slots.append(msp_session.login_slot('10.0.0.1'))
+        for slot in slots:
+            msp_session.unlock_file(slot)
+
+    def test_unlimited(self):
+        os.environ['MSP_LOGIN_LIMIT'] = '0'
+        self.assertIsNone(msp_session.login_slot('10.0.0.1'))
+
+
+class CircuitBreakerTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        os.environ['MSP_BREAKER_FAILURES'] = '2'
+        os.environ['MSP_BREAKER_RESET'] = '300'
+        self.logins = []
+
+    def login(self, error=None):
+        def login():
+            self.logins.append(error)
+            if error is not None:
+                raise error
+            return 'session'
+        return msp_session.CircuitBreaker('10.0.0.1').guard(login)
+
+    def test_opens_after_failures(self):
+        for n in range(2):
+            with self.assertRaises(msp_session.HostDown):
+                self.login(msp_session.HostDown('CRITICAL: could not login with SSH.'))
+        with self.assertRaises(msp_session.SessionError) as e:
+            self.login()
+        self.assertEqual(e.exception.exit, msp_session.STATE_UNKNOWN)
+        self.assertEqual(len(self.logins), 2)
+
+    def test_success_resets(self):
+        with self.assertRaises(msp_session.HostDown):
+            self.login(msp_session.HostDown('CRITICAL: connection refused'))
+        self.assertEqual(self.login(), 'session')
+        with self.assertRaises(msp_session.HostDown):
+            self.login(msp_session.HostDown('CRITICAL: connection refused'))
+        self.assertEqual(self.login(), 'session')
+
+    def test_other_errors_not_counted(self):
+        for n in range(3):
+            with self.assertRaises(msp_session.SessionError):
+                self.login(msp_session.SessionError('CRITICAL: permission denied; possible invalid password.'))
+        self.assertEqual(len(self.logins), 3)
+
+    def test_half_open_probe(self):
+        for n in range(2):
+            with self.assertRaises(msp_session.HostDown):
+                self.login(msp_session.HostDown('CRITICAL: connection refused'))
+        breaker = msp_session.CircuitBreaker('10.0.0.1')
+        state = breaker.read()
+        state['opened'] -= 301
+        with open(breaker.path, 'w') as f:
+            json.dump(state, f)
+        # one probe is let through while the others keep failing fast
+        probe = breaker.check()
+        self.assertIsNotNone(probe)
+        with self.assertRaises(msp_session.SessionError):
+            breaker.check()
+        msp_session.unlock_file(probe)
+        self.assertEqual(self.login(), 'session')
+        self.assertEqual(breaker.read(), {'failures': 0, 'opened': 0})
+
+
+class LoginTest(StateDirTest):
+
+    def session(self, ssh):
+        session = msp_session.Session('fakehost', '127.0.0.1', 'user', 'password')
+        session.spawn_command = lambda: ssh
+        return session
+
+    def test_ssh_exits_at_once(self):
+        ssh = self.script('ssh', '#!/bin/sh\n'
+                          'echo "ssh: connect to host 127.0.0.1 port 22: No route to host"\n'
+                          'exit 255\n')
+        os.environ['MSP_BREAKER_FAILURES'] = '2'
+        for n in range(2):
+            session = self.session(ssh)
+            with self.assertRaises(msp_session.HostDown) as e:
+                session.login()
+            self.assertIn('No route to host', e.exception.resp)
+            self.assertIsNone(session.child)
+        # the breaker counted both and now fails fast without spawning ssh
+        session = self.session('/nonexistent/ssh')
+        with self.assertRaises(msp_session.SessionError) as e:
+            session.login()
+        self.assertEqual(e.exception.exit, msp_session.STATE_UNKNOWN)
+        self.assertIn('did not answer the last 2 logins', e.exception.resp)
+
+    def test_ssh_exits_after_password(self):
+        ssh = self.script('ssh', '#!/bin/sh\n'
+                          'printf "password: "; read p\n'
+                          'echo "Permission denied (publickey,password)."\n'
+                          'exit 255\n')
+        with self.assertRaises(msp_session.SessionError) as e:
+            self.session(ssh).login()
+        self.assertNotIsInstance(e.exception, msp_session.HostDown)
+        self.assertIn('permission denied', e.exception.resp)
+        self.assertEqual(msp_session.CircuitBreaker('127.0.0.1').read()['failures'], 0)
+
+
+class ResultCacheTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        self.cache = msp_session.ResultCache(os.path.join(self.state, 'cache'), 4096)
+        os.mkdir(self.cache.path)
+
+    def test_put_get(self):
+        self.cache.put('u@host 10.0.0.1', 'df -kh', 'output')
+        self.assertEqual(self.cache.get('u@host 10.0.0.1', 'df -kh', 60), 'output')
+        self.assertIsNone(self.cache.get('u@host 10.0.0.2', 'df -kh', 60))
+        self.assertIsNone(self.cache.get('u@host 10.0.0.1', 'df -k', 60))
+        # stored before since, or older than the ttl
+        self.assertIsNone(self.cache.get('u@host 10.0.0.1', 'df -kh', 60, time.time() + 1))
+        self.assertIsNone(self.cache.get('u@host 10.0.0.1', 'df -kh', 0))
+
+    def test_evict_oldest(self):
+        for n in range(8):
+            self.cache.put('host', 'command %d' % (n), 'x' * 1000)
+            os.utime(self.cache.filename('host', 'command %d' % (n)), (n, n))
+        self.cache.evict()
+        kept = [n for n in range(8) if self.cache.get('host', 'command %d' % (n), 1e10) is not None]
+        self.assertEqual(kept, [5, 6, 7])
+
+    def test_evict_leaves_entries_being_written(self):
+        tmp = self.cache.filename('host', 'df -kh') + '.123.tmp'
+        stale = self.cache.filename('host', 'uptime') + '.456.tmp'
+        for path in (tmp, stale):
+            with open(path, 'w') as f:
+                f.write('x' * 10000)
+        old = time.time() - msp_session.COMMAND_TIMEOUT - 10
+        os.utime(stale, (old, old))
+        self.cache.evict()
+        self.assertTrue(os.path.exists(tmp))
+        self.assertFalse(os.path.exists(stale))
+
+    def test_failed_store_is_dropped(self):
+        self.cache.path = os.path.join(self.state, 'gone')
+        self.cache.put('host', 'df -kh', 'output')
+        self.assertIsNone(self.cache.get('host', 'df -kh', 60))
+
+
+class SlowSession(CannedSession):
+    """CannedSession whose commands take a while, as on a real server."""
+
+    def answer(self, command):
+        time.sleep(0.3)
+        return CannedSession.answer(self, command)
+
+    def close(self):
+        pass
+
+
+class CachedSessionTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        self.opened = []
+
+    def cached(self):
+        def opener():
+            session = SlowSession({'df -kh': ('Filesystem Size\n', 0), 'uptime': ('up 3 days\n', 0),
+                                   'nsctrl status': ('failed\n', 1)})
+            self.opened.append(session)
+            return session
+        return msp_session.CachedSession(opener, 'host', '10.0.0.1', 'user')
+
+    def commands(self):
+        return [command for session in self.opened for command in session.commands]
+
+    def test_cached_without_login(self):
+        self.assertEqual(self.cached().run('df -kh'), 'Filesystem Size\n')
+        self.assertEqual(self.cached().run('df -kh'), 'Filesystem Size\n')
+        self.assertEqual(len(self.opened), 1)
+
+    def test_not_cached(self):
+        # uptime is not read-only listed; a failed command is not stored
+        for n in range(2):
+            session = self.cached()
+            self.assertEqual(session.run_many(['uptime', 'nsctrl status']),
+                             [('up 3 days\n', 0), ('failed\n', 1)])
+        self.assertEqual(self.commands(), ['uptime', 'nsctrl status'] * 2)
+
+    def test_bypass(self):
+        self.cached().run('df -kh')
+        os.environ['NAGIOS_SERVICEATTEMPT'] = '2'
+        self.cached().run('df -kh')
+        self.assertEqual(self.commands(), ['df -kh', 'df -kh'])
+
+    def test_single_flight(self):
+        outputs = []
+        threads = [threading.Thread(target=lambda: outputs.append(self.cached().run('df -kh')))
+                   for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outputs, ['Filesystem Size\n'] * 5)
+        self.assertEqual(self.commands(), ['df -kh'])
+
+    def test_login_failure_remembered(self):
+        calls = []
+        def opener():
+            calls.append(1)
+            raise msp_session.HostDown('CRITICAL: connection refused')
+        session = msp_session.CachedSession(opener, 'host', '10.0.0.1', 'user')
+        for n in range(2):
+            with self.assertRaises(msp_session.HostDown):
+                session.run('uptime')
+        self.assertEqual(len(calls), 1)
+
+    def test_cancel(self):
+        session = self.cached()
+        session.run('uptime')
+        session.cancel()
+        with self.assertRaises(msp_session.SessionError):
+            session.run('uptime')
+
+
+PROBE_OUTPUT = '''\
+MSP_SHELL -bash
+MSP_COMMAND ifconfig /sbin/ifconfig
+MSP_COMMAND ip /sbin/ip
+MSP_COMMAND nsctrl /opt/miep/bin/nsctrl
+MSP_SUDO ifconfig
+'''
+
+
+class CapabilitiesTest(StateDirTest):
+
+    def session(self, output=PROBE_OUTPUT):
+        session = CannedSession({"echo 'MSP_''SHELL'": (output, 0)})
+        session.username = 'user'
+        session.hostname = 'host'
+        return session
+
+    def test_probe(self):
+        session = self.session()
+        probe = msp_session.capabilities(session)
+        self.assertEqual(probe['shell'], '-bash')
+        self.assertEqual(probe['commands'], {'ifconfig': '/sbin/ifconfig', 'ip': '/sbin/ip',
+                                             'nsctrl': '/opt/miep/bin/nsctrl'})
+        self.assertEqual(probe['sudo'], ['ifconfig'])
+        # kept, so the next check does not probe again
+        self.assertEqual(msp_session.capabilities(session)['commands'], probe['commands'])
+        self.assertEqual(len(session.commands), 1)
+
+    def test_probe_again(self):
+        session = self.session()
+        msp_session.capabilities(session)
+        os.environ['NAGIOS_SERVICEATTEMPT'] = '2'
+        msp_session.capabilities(session)
+        del os.environ['NAGIOS_SERVICEATTEMPT']
+        os.environ['MSP_PROBE_TTL'] = '0'
+        msp_session.capabilities(session)
+        del os.environ['MSP_PROBE_TTL']
+        msp_session.forget_capabilities(session)
+        msp_session.capabilities(session)
+        self.assertEqual(len(session.commands), 4)
+
+    def test_local_shell(self):
+        session = LocalSession()
+        session.username = 'user'
+        session.hostname = 'localhost'
+        probe = msp_session.capabilities(session)
+        self.assertIsNotNone(probe['shell'])
+        for name, path in probe['commands'].items():
+            self.assertIn(name, msp_session.PROBE_COMMANDS)
+            self.assertTrue(os.path.isabs(path), path)
+
+
+class ExecRunManyTest(StateDirTest):
+
+    def setUp(self):
+        StateDirTest.setUp(self)
+        # an ssh that runs the command it is given locally
+        self.ssh_program = msp_session.SSH_PROGRAM
+        msp_session.SSH_PROGRAM = self.script('ssh', '#!/bin/sh\nfor a; do c=$a; done\ncd %s && exec sh -c "$c"\n'
+                                              % (self.state))
+        self.session = msp_session.ExecSession('host', '127.0.0.1', 'user', 'password')
+        self.procs = []
+        start = self.session.start
+        def record(command):
+            proc = start(command)
+            self.procs.append(proc)
+            return proc
+        self.session.start = record
+
+    def tearDown(self):
+        msp_session.SSH_PROGRAM = self.ssh_program
+        StateDirTest.tearDown(self)
+
+    def test_in_order(self):
+        results = self.session.run_many(['sleep 0.3; echo done > f', 'cat f; rm f'])
+        self.assertEqual(results, [('', 0), ('done\n', 0)])
+
+    def test_parallel(self):
+        start = time.time()
+        results = self.session.run_many(['sleep 0.5; echo a', 'sleep 0.5; echo b'], parallel=True)
+        self.assertEqual(results, [('a\n', 0), ('b\n', 0)])
+        self.assertLess(time.time() - start, 0.9)
+
+    def test_timeout_leaves_nothing_running(self):
+        for parallel in (False, True):
+            self.procs = []
+            with self.assertRaises(pexpect.TIMEOUT):
+                self.session.run_many(['exec sleep 5'] * 3, timeout=0.5, parallel=parallel)
+            self.assertTrue(self.procs)
+            self.assertEqual([proc for proc in self.procs if proc.returncode is None], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
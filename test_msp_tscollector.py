@@ -0,0 +1,82 @@
+# -*- coding: UTF-8 -*-
+#
+# Tests for msp_tscollector.py that need no SSH server.
+#
+# $ python -m unittest test_msp_tscollector
+#
+
+from __future__ import absolute_import
+import time
+import unittest
+
+import msp_tscollector
+
+REQUEST = '2026-10-18 10:00:01 DEBUG Sending request to TS 10.1.1.5\n'
+RESPONSE = '2026-10-18 10:00:01 DEBUG Receiving response from TS 10.1.1.5\n'
+
+
+class Clock(object):
+    """Stands in for time.time() in msp_tscollector."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TSCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.time = msp_tscollector.time.time
+        # 20 seconds into a minute
+        self.clock = msp_tscollector.time.time = Clock(1800000000 - 1800000000 % 60 + 20)
+        self.counter = msp_tscollector.TSCounter(60)
+
+    def tearDown(self):
+        msp_tscollector.time.time = self.time
+
+    def test_no_tail(self):
+        self.assertIsNone(self.counter.counts(5))
+
+    def test_span_of_partial_minute(self):
+        self.counter.start()
+        self.clock.now += 600
+        self.counter.feed(REQUEST + REQUEST + RESPONSE)
+        # four whole minutes and the 20 seconds of the current one
+        self.assertEqual(self.counter.counts(5), (2, 1, 260, 260, True))
+
+    def test_lines_split_over_reads(self):
+        self.counter.start()
+        self.counter.feed(REQUEST[:10])
+        self.counter.feed(REQUEST[10:] + RESPONSE[:30])
+        self.counter.feed(RESPONSE[30:])
+        self.assertEqual(self.counter.counts(1)[:2], (1, 1))
+
+    def test_tail_started_within_window(self):
+        self.counter.start()
+        self.clock.now += 110
+        requests, responses, span, seconds, complete = self.counter.counts(5)
+        self.assertEqual((span, seconds, complete), (250, 110, False))
+
+    def test_restart_within_window(self):
+        self.counter.start()
+        self.clock.now += 600
+        self.counter.pause()
+        self.clock.now += 3
+        self.counter.start()
+        self.clock.now += 30
+        requests, responses, span, seconds, complete = self.counter.counts(5)
+        self.assertEqual((span, seconds, complete), (293, 290, False))
+        # once the restart is out of the window the counts are whole again
+        self.clock.now += 300
+        self.assertEqual(self.counter.counts(5)[2:], (293, 293, True))
+
+    def test_stop(self):
+        self.counter.start()
+        self.counter.stop()
+        self.assertIsNone(self.counter.counts(5))
+
+
+if __name__ == '__main__':
+    unittest.main()